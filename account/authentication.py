@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_cache_key(user_id):
+    return f"auth:user-fields:{user_id}"
+
+
+def forget_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def _cache_entry(user):
+    # Only what the checks need; the password hash itself never leaves the database.
+    return {
+        "id": user.pk,
+        "username": user.get_username(),
+        "is_active": user.is_active,
+        "password_digest": get_md5_hash_password(user.password),
+    }
+
+
+def _user_from_entry(entry):
+    # Every other field is deferred and loaded from the database if a view reads it.
+    User = get_user_model()
+    fields = [User._meta.pk.attname, User.USERNAME_FIELD, "is_active"]
+    return User.from_db(router.db_for_read(User), fields, [entry["id"], entry["username"], entry["is_active"]])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that serves read-only requests from a user cache.
+
+    Tokens are still validated in-process on every request. For safe
+    methods the user is then rebuilt from a cache entry holding its id,
+    username, active flag and a digest of its password hash, kept for
+    AUTH_USER_CACHE_TIMEOUT seconds, so an authenticated GET needs no query
+    to authenticate; other fields load on first access. Writes always load
+    the user from the database.
+
+    The account signals drop a user's entry whenever it is saved or deleted.
+    With a shared cache every worker sees that at once; with the local-memory
+    cache only the worker that saved the user does, and elsewhere a
+    deactivation or password change takes up to AUTH_USER_CACHE_TIMEOUT to
+    apply. Queryset ``update()`` calls bypass the signals and always wait
+    out the timeout.
+    """
+
+    def authenticate(self, request):
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = user_cache_key(user_id)
+        entry = cache.get(key) if getattr(self, "use_cache", False) else None
+        if entry is None:
+            user = super().get_user(validated_token)
+            cache.set(key, _cache_entry(user), settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+
+        # The same checks JWTAuthentication makes against a freshly loaded user.
+        if api_settings.CHECK_USER_IS_ACTIVE and not entry["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry["password_digest"]:
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return _user_from_entry(entry)
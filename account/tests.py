@@ -1,3 +1,63 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication, user_cache_key
+from .models import CustomUser
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="reader", password="first-pw", email="reader@example.com")
+
+    def authenticate(self, token, method="get"):
+        request = getattr(APIRequestFactory(), method)("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_read_only_requests_are_served_from_the_cache(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            self.authenticate(token)
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, "reader", True))
+
+        entry = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn(self.user.password, entry.values())
+        # Fields outside the entry are still there, loaded on demand.
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "reader@example.com")
+
+    def test_writes_always_load_the_user(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        with self.assertNumQueries(1):
+            self.authenticate(token, method="post")
+
+    def test_deactivation_takes_effect_on_save(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_password_change_revokes_cached_tokens(self):
+        with mock.patch.object(api_settings, "CHECK_REVOKE_TOKEN", True):
+            old_token = AccessToken.for_user(self.user)
+            self.authenticate(old_token)
+            self.user.set_password("second-pw")
+            self.user.save()
 
-# Create your tests here.
+            new_token = AccessToken.for_user(self.user)
+            self.authenticate(new_token)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.authenticate(new_token).pk, self.user.pk)
+                with self.assertRaises(AuthenticationFailed):
+                    self.authenticate(old_token)
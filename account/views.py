@@ -4,6 +4,8 @@ from rest_framework.response import Response
 from django.contrib.auth import login
 from django.shortcuts import redirect
 from django.urls import reverse
+from rest_framework_simplejwt.views import TokenObtainPairView
+from shop.throttling import LoginThrottle
 from .serializers import UserRegistrationSerializer
 
 class UserRegistrationView(APIView):
@@ -18,4 +20,9 @@ class UserRegistrationView(APIView):
                 'username': user.username
             }, status=status.HTTP_201_CREATED)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    # Every attempt runs the password hasher, so cap them per client.
+    throttle_classes = [LoginThrottle]
@@ -0,0 +1,89 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, urlencode
+from rest_framework.renderers import JSONRenderer
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock rather than 1 so a version lost to eviction or a
+        # restart can never collide with responses cached under an old one.
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+def _response_key(endpoint, request, args, kwargs, version):
+    parts = [
+        endpoint,
+        str(version),
+        request.get_host(),
+        request.path,
+        urlencode(sorted(request.GET.lists()), doseq=True),
+        request.headers.get("Accept", ""),
+        repr(args),
+        repr(sorted(kwargs.items())),
+    ]
+    digest = hashlib.sha256("\n".join(parts).encode()).hexdigest()
+    return f"catalog:response:{endpoint}:{digest}"
+
+
+def cached_catalog_response(endpoint):
+    """Cache a catalog view's rendered response until the catalog changes.
+
+    Entries are keyed by the catalog version, so bumping the version
+    invalidates every cached response at once. The key doubles as a strong
+    ETag, which lets ``If-None-Match`` be answered before any database work.
+    Only JSON responses are cached: the browsable API's HTML carries the
+    requester's CSRF token and user, so it is rendered afresh each time.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            key = _response_key(endpoint, request, args, kwargs, get_catalog_version())
+            etag = f'"{key.rsplit(":", 1)[-1]}"'
+
+            if etag in parse_etags(request.headers.get("If-None-Match", "")):
+                response = HttpResponseNotModified()
+            else:
+                cached = cache.get(key)
+                if cached is not None:
+                    content, content_type = cached
+                    response = HttpResponse(content, content_type=content_type)
+                else:
+                    response = view(request, *args, **kwargs)
+                    renderer = getattr(response, "accepted_renderer", None)
+                    if response.status_code != 200 or response.streaming or not isinstance(renderer, JSONRenderer):
+                        return response
+                    if hasattr(response, "render"):
+                        response.render()
+                    cache.set(key, (response.content, response["Content-Type"]), settings.CATALOG_CACHE_TIMEOUT)
+
+            response["ETag"] = etag
+            patch_vary_headers(response, ["Accept"])
+            return response
+
+        return wrapper
+
+    return decorator
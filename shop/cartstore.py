@@ -0,0 +1,299 @@
+import time
+import uuid
+from datetime import datetime
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+DIRTY_KEY = "cart:dirty"
+FLUSH_LOCK_TIMEOUT = 30
+
+# Delete KEYS[1] only if it still holds our token ARGV[1].
+RELEASE_LOCK = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisCartStore:
+    """Write-behind store for live (unpaid) carts.
+
+    A cart lives in two Redis hashes: ``cart:<code>:items`` maps product ids
+    to quantities and ``cart:<code>:meta`` holds the database ids and a
+    revision counter. Mutations only touch Redis and mark the cart dirty;
+    ``flush`` writes a cart's lines back to ``Cart``/``CartItem``. The Cart
+    row itself is created up front, so cart ids, owners and cart codes stay
+    queryable in the database.
+    """
+
+    def __init__(self, client, ttl=None):
+        self.client = client
+        self.ttl = ttl or settings.CART_STORE_TTL
+        self._release = client.register_script(RELEASE_LOCK)
+
+    @staticmethod
+    def items_key(cart_code):
+        return f"cart:{cart_code}:items"
+
+    @staticmethod
+    def meta_key(cart_code):
+        return f"cart:{cart_code}:meta"
+
+    @staticmethod
+    def ids_key(cart_code):
+        return f"cart:{cart_code}:ids"
+
+    def _keys(self, cart_code):
+        return self.items_key(cart_code), self.meta_key(cart_code), self.ids_key(cart_code)
+
+    def load(self, cart_code, user_id=None, create=False):
+        """Make sure ``cart_code`` is in Redis and return its metadata.
+
+        Returns None when there is no unpaid cart with that code, unless
+        ``create`` is set and no cart (paid or not) has the code yet.
+        Concurrent loads of the same cart seed Redis once: the others see
+        the seeded copy and keep any changes made to it in the meantime.
+        """
+        meta_key = self.meta_key(cart_code)
+        meta = self.client.hgetall(meta_key)
+        if meta:
+            return meta
+
+        if create:
+            cart, _ = Cart.objects.get_or_create(cart_code=cart_code, defaults={"user_id": user_id})
+        else:
+            cart = Cart.objects.filter(cart_code=cart_code).first()
+        if cart is None or cart.paid:
+            return None
+        lines = list(CartItem.objects.filter(cart=cart).values_list("product_id", "quantity", "id"))
+
+        meta = {
+            "cart_id": cart.pk,
+            "user_id": cart.user_id or "",
+            "created_at": cart.created_at.isoformat() if cart.created_at else "",
+            "modified_at": cart.modified_at.isoformat() if cart.modified_at else "",
+            "rev": 0,
+        }
+        items_key, ids_key = self.items_key(cart_code), self.ids_key(cart_code)
+        with self.client.pipeline() as pipe:
+            try:
+                # Seed only if nobody else has in the meantime; every
+                # mutation touches the meta hash, so watching it is enough.
+                pipe.watch(meta_key)
+                if pipe.exists(meta_key):
+                    pipe.unwatch()
+                    return self.client.hgetall(meta_key)
+                pipe.multi()
+                pipe.delete(items_key, ids_key)
+                if lines:
+                    pipe.hset(items_key, mapping={product_id: quantity for product_id, quantity, _ in lines})
+                    pipe.hset(ids_key, mapping={product_id: item_id for product_id, _, item_id in lines})
+                pipe.hset(meta_key, mapping=meta)
+                self._expire(pipe, cart_code)
+                pipe.execute()
+            except redis.WatchError:
+                return self.client.hgetall(meta_key)
+        return {key: str(value) for key, value in meta.items()}
+
+    def _expire(self, pipe, cart_code):
+        for key in self._keys(cart_code):
+            pipe.expire(key, self.ttl)
+
+    def _touch(self, pipe, cart_code):
+        meta_key = self.meta_key(cart_code)
+        pipe.hincrby(meta_key, "rev", 1)
+        pipe.hset(meta_key, "modified_at", timezone.now().isoformat())
+        pipe.sadd(DIRTY_KEY, cart_code)
+        self._expire(pipe, cart_code)
+
+    def add(self, cart_code, product_id, quantity=1):
+        """Increment a line and return ``(quantity, item_id or None)``."""
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.items_key(cart_code), product_id, quantity)
+        pipe.hget(self.ids_key(cart_code), product_id)
+        self._touch(pipe, cart_code)
+        new_quantity, item_id = pipe.execute()[:2]
+        return new_quantity, int(item_id) if item_id else None
+
+    def set(self, cart_code, product_id, quantity):
+        pipe = self.client.pipeline()
+        if quantity > 0:
+            pipe.hset(self.items_key(cart_code), product_id, quantity)
+        else:
+            pipe.hdel(self.items_key(cart_code), product_id)
+        self._touch(pipe, cart_code)
+        pipe.execute()
+
+    def apply(self, cart_code, operations):
+        """Apply ``(op, product_id, quantity)`` operations in one round trip."""
+        pipe = self.client.pipeline()
+        items_key = self.items_key(cart_code)
+        for op, product_id, quantity in operations:
+            if op == "add":
+                pipe.hincrby(items_key, product_id, quantity)
+            elif op == "set" and quantity > 0:
+                pipe.hset(items_key, product_id, quantity)
+            else:
+                pipe.hdel(items_key, product_id)
+        self._touch(pipe, cart_code)
+        pipe.execute()
+
+    def remove(self, cart_code, product_id):
+        self.set(cart_code, product_id, 0)
+
+    def quantity(self, cart_code, product_id):
+        return int(self.client.hget(self.items_key(cart_code), product_id) or 0)
+
+    def quantities(self, cart_code, product_ids):
+        """Return ``{product_id: quantity}`` for ``product_ids`` with one HMGET."""
+        values = self.client.hmget(self.items_key(cart_code), product_ids)
+        return {product_id: int(value or 0) for product_id, value in zip(product_ids, values)}
+
+    def lines(self, cart_code):
+        """Return ``{product_id: (quantity, item_id or None)}`` for the cart."""
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.items_key(cart_code))
+        pipe.hgetall(self.ids_key(cart_code))
+        items, ids = pipe.execute()
+        return {
+            int(product_id): (int(quantity), int(ids[product_id]) if product_id in ids else None)
+            for product_id, quantity in items.items()
+        }
+
+    def snapshot(self, cart_code):
+        """Build an unsaved Cart, with its items, from the Redis copy.
+
+        The result can be passed to the regular cart serializers. Returns
+        None if the cart does not exist.
+        """
+        meta = self.load(cart_code)
+        if meta is None:
+            return None
+        lines = self.lines(cart_code)
+        products = Product.objects.in_bulk(list(lines))
+
+        cart = Cart(
+            id=int(meta["cart_id"]),
+            cart_code=cart_code,
+            user_id=int(meta["user_id"]) if meta.get("user_id") else None,
+            created_at=_parse_datetime(meta.get("created_at")),
+            modified_at=_parse_datetime(meta.get("modified_at")),
+        )
+        items = [
+            CartItem(id=item_id, cart=cart, product=products[product_id], quantity=quantity)
+            for product_id, (quantity, item_id) in sorted(lines.items(), key=lambda line: (line[1][1] is None, line[1][1] or 0, line[0]))
+            if product_id in products
+        ]
+        cart._prefetched_objects_cache = {"items": items}
+        cart.item_count = sum(item.quantity for item in items)
+        cart.subtotal = sum((item.quantity * item.product.price for item in items), start=0)
+        return cart
+
+    def item_count(self, cart_code):
+        meta = self.load(cart_code)
+        if meta is None:
+            return None, None
+        items = _in_catalog(self.client.hgetall(self.items_key(cart_code)))
+        return int(meta["cart_id"]), sum(items.values())
+
+    def flush(self, cart_code, wait=False):
+        """Write the Redis copy of ``cart_code`` to the database.
+
+        If another worker is already flushing the cart this returns False,
+        unless ``wait`` is set, in which case it waits for that flush and
+        then writes the cart as it stands once the lock is ours.
+        """
+        # Two workers flushing the same cart would both insert its new lines.
+        lock_key = f"cart:{cart_code}:flushing"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + FLUSH_LOCK_TIMEOUT
+        while not self.client.set(lock_key, token, nx=True, ex=FLUSH_LOCK_TIMEOUT):
+            if not wait or time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        try:
+            # Read under the lock, so a waiter never writes a snapshot older
+            # than the one the previous holder just wrote.
+            pipe = self.client.pipeline()
+            pipe.hgetall(self.meta_key(cart_code))
+            pipe.hgetall(self.items_key(cart_code))
+            meta, items = pipe.execute()
+            if not meta:
+                self.client.srem(DIRTY_KEY, cart_code)
+                return False
+            return self._write(cart_code, meta, items)
+        finally:
+            # The lock may have expired and been taken by another worker.
+            self._release(keys=[lock_key], args=[token])
+
+    def _write(self, cart_code, meta, items):
+        meta_key, ids_key = self.meta_key(cart_code), self.ids_key(cart_code)
+        with transaction.atomic():
+            # complete_transactions marks the cart paid before it evicts the
+            # Redis copy; a flush in between must not rewrite a paid cart.
+            cart = Cart.objects.select_for_update().filter(pk=int(meta["cart_id"]), paid=False).first()
+            if cart is None:
+                self.evict(cart_code)
+                return False
+            ids = cart.sync_lines(_in_catalog(items))
+
+        # Only clear the dirty flag if nothing changed while we were writing.
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(meta_key)
+                unchanged = pipe.hget(meta_key, "rev") == meta["rev"]
+                pipe.multi()
+                pipe.delete(ids_key)
+                if ids:
+                    pipe.hset(ids_key, mapping=ids)
+                    pipe.expire(ids_key, self.ttl)
+                if unchanged:
+                    pipe.srem(DIRTY_KEY, cart_code)
+                pipe.execute()
+            except redis.WatchError:
+                pass
+        return True
+
+    def flush_dirty(self, batch_size=None):
+        """Flush up to ``batch_size`` dirty carts; return how many were written."""
+        batch_size = batch_size or settings.CART_STORE_FLUSH_BATCH
+        codes = self.client.srandmember(DIRTY_KEY, batch_size)
+        return sum(1 for cart_code in codes if self.flush(cart_code))
+
+    def evict(self, cart_code):
+        """Drop a cart from Redis, e.g. once it has been paid for."""
+        pipe = self.client.pipeline()
+        pipe.delete(*self._keys(cart_code))
+        pipe.srem(DIRTY_KEY, cart_code)
+        pipe.execute()
+
+
+def _in_catalog(items):
+    """``{product_id: quantity}`` for the lines whose product still exists."""
+    quantities = {int(product_id): int(quantity) for product_id, quantity in items.items()}
+    existing = Product.objects.filter(pk__in=quantities).values_list("pk", flat=True)
+    return {product_id: quantities[product_id] for product_id in existing}
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+_store = None
+
+
+def get_cart_store():
+    """Return the configured cart store, or None when carts live in the database only."""
+    global _store
+    if _store is None and settings.CART_STORE_URL:
+        client = redis.Redis.from_url(settings.CART_STORE_URL, decode_responses=True)
+        _store = RedisCartStore(client)
+    return _store
@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+from django.db.models import Count, F, IntegerField, Max, Min, Value
+from django.db.models.functions import Cast, Floor
+
+from .models import Product
+
+DEFAULT_BUCKETS = 10
+MAX_BUCKETS = 50
+CENT = Decimal("0.01")
+
+
+def _price(value):
+    # Rendered as strings, like the DecimalFields of the product serializers.
+    return str(value.quantize(CENT)) if value is not None else None
+
+
+def compute_facets(queryset, bucket_count=DEFAULT_BUCKETS):
+    """Category counts and a price histogram for ``queryset`` in two queries."""
+    stats = queryset.aggregate(total=Count("id"), min_price=Min("price"), max_price=Max("price"))
+    categories = {value: 0 for value, _ in Product.CATEGORY}
+    histogram = []
+
+    if stats["total"]:
+        low, high = stats["min_price"], stats["max_price"]
+        width = (high - low) / bucket_count
+        if width:
+            bucket = Cast(Floor((F("price") - Value(low)) / Value(width)), IntegerField())
+        else:
+            bucket = Value(0, output_field=IntegerField())
+
+        counts = [0] * bucket_count
+        rows = queryset.order_by().annotate(bucket=bucket).values("category", "bucket").annotate(count=Count("id"))
+        for row in rows:
+            if row["category"] in categories:
+                categories[row["category"]] += row["count"]
+            # The maximum price lands exactly on the upper edge of the last bucket.
+            counts[min(row["bucket"], bucket_count - 1)] += row["count"]
+
+        for index, count in enumerate(counts):
+            histogram.append({
+                "min": _price(low + width * index),
+                "max": _price(low + width * (index + 1) if index < bucket_count - 1 else high),
+                "count": count,
+            })
+
+    return {
+        "total": stats["total"],
+        "categories": [
+            {"value": value, "label": label, "count": categories[value]}
+            for value, label in Product.CATEGORY
+        ],
+        "price": {
+            "min": _price(stats["min_price"]),
+            "max": _price(stats["max_price"]),
+            "histogram": histogram,
+        },
+    }
@@ -0,0 +1,18 @@
+import django_filters
+
+from .models import Product
+
+CATEGORIES = {value.lower(): value for value, _ in Product.CATEGORY}
+
+
+class ProductFilter(django_filters.FilterSet):
+    category = django_filters.CharFilter(method="filter_category")
+    min_price = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    max_price = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
+
+    class Meta:
+        model = Product
+        fields = ["category", "min_price", "max_price"]
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(category=CATEGORIES.get(value.lower(), value))
@@ -0,0 +1,227 @@
+import random
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Responses worth retrying: the gateway is overloaded or briefly broken.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class GatewayError(Exception):
+    """A payment gateway call failed after all retries."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(GatewayError):
+    """The gateway has been failing; calls are refused until it cools down."""
+
+
+class CircuitBreaker:
+    """Fail fast after ``failure_threshold`` consecutive failed calls.
+
+    Once open, calls are refused for ``reset_timeout`` seconds. After that a
+    single trial call is let through: success closes the circuit again and
+    failure reopens it. State is per process.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.PAYMENT_GATEWAY_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or settings.PAYMENT_GATEWAY_BREAKER_RESET
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self.trial_running):
+                raise CircuitOpenError(f"{self.name} is unavailable, try again shortly", status_code=503)
+            if state == "half-open":
+                self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a call that neither succeeded nor failed against the gateway."""
+        with self.lock:
+            self.trial_running = False
+
+
+def _never_sent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class GatewayClient:
+    """HTTP client for one payment gateway.
+
+    Connections are pooled in a shared ``requests.Session`` and every call
+    has connect and read timeouts. Failed calls are retried a bounded number
+    of times with jittered exponential backoff, and a circuit breaker makes
+    callers fail fast while the gateway is down; a call counts once against
+    the breaker however many attempts it made. Only idempotent requests are
+    retried after the request may have reached the gateway.
+    """
+
+    def __init__(self, name, base_url, headers=None, timeout=None, retries=None, backoff=None, pool_size=None, breaker=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout or settings.PAYMENT_GATEWAY_TIMEOUT
+        self.retries = settings.PAYMENT_GATEWAY_RETRIES if retries is None else retries
+        self.backoff = settings.PAYMENT_GATEWAY_BACKOFF if backoff is None else backoff
+        self.breaker = breaker or CircuitBreaker(name)
+
+        pool_size = pool_size or settings.PAYMENT_GATEWAY_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+
+    def _sleep(self, attempt):
+        # "Full jitter": spreads retries from many workers across the window.
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """Send a request and return the ``requests.Response``.
+
+        Raises GatewayError once retries are exhausted, or CircuitOpenError
+        without calling the gateway while the circuit is open. 4xx responses
+        are returned to the caller and do not count as gateway failures.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in ("GET", "HEAD", "PUT", "DELETE")
+        kwargs.setdefault("timeout", self.timeout)
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        self.breaker.before_call()
+        try:
+            response = self._send(method, url, idempotent, kwargs)
+        except GatewayError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Not the gateway's fault, but a half-open trial must not stay
+            # claimed or the circuit would never close again.
+            self.breaker.release_trial()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def _send(self, method, url, idempotent, kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError as e:
+                # A request that never reached the gateway is safe to resend
+                # even when it is not idempotent.
+                error = GatewayError(f"{self.name} connection failed: {e}", status_code=503)
+                retryable = idempotent or _never_sent(e)
+            except requests.Timeout:
+                error, retryable = GatewayError(f"{self.name} timed out", status_code=504), idempotent
+            except requests.RequestException as e:
+                # E.g. the connection dropped halfway through the response body.
+                error, retryable = GatewayError(f"{self.name} request failed: {e}", status_code=502), idempotent
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = GatewayError(f"{self.name} returned {response.status_code}", status_code=response.status_code)
+                retryable = idempotent or response.status_code == 429
+
+            if not retryable or attempt >= self.retries:
+                raise error
+            self._sleep(attempt)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+
+_flutterwave = None
+_flutterwave_lock = threading.Lock()
+
+
+def flutterwave():
+    """Return the process-wide Flutterwave client."""
+    global _flutterwave
+    with _flutterwave_lock:
+        if _flutterwave is None:
+            _flutterwave = GatewayClient(
+                "Flutterwave",
+                settings.FLUTTERWAVE_BASE_URL,
+                headers={"Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}"},
+            )
+    return _flutterwave
+
+
+stripe_breaker = CircuitBreaker("Stripe")
+
+
+def configure_stripe():
+    """Point the Stripe SDK at a pooled, timeout-bounded HTTP client."""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE, max_retries=0))
+    session.mount("http://", HTTPAdapter(pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE, max_retries=0))
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.default_http_client = stripe.RequestsClient(timeout=settings.PAYMENT_GATEWAY_TIMEOUT, session=session)
+    # The SDK retries with jittered backoff and idempotency keys on its own.
+    stripe.max_network_retries = settings.PAYMENT_GATEWAY_RETRIES
+
+
+def stripe_call(method, *args, **kwargs):
+    """Call a Stripe SDK method behind the Stripe circuit breaker.
+
+    Connection failures and Stripe-side errors count against the breaker
+    and are raised as GatewayError; card and request errors are the
+    caller's problem and propagate unchanged.
+    """
+    stripe_breaker.before_call()
+    try:
+        result = method(*args, **kwargs)
+    except (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError) as e:
+        stripe_breaker.record_failure()
+        raise GatewayError(f"Stripe request failed: {e.user_message or e}", status_code=e.http_status or 503) from e
+    except stripe.error.StripeError:
+        stripe_breaker.record_success()
+        raise
+    except BaseException:
+        stripe_breaker.release_trial()
+        raise
+    stripe_breaker.record_success()
+    return result
@@ -0,0 +1,177 @@
+"""A local stand-in for the Flutterwave and Stripe APIs.
+
+Implements the handful of endpoints the shop calls, keeps payments in
+memory and marks them successful straight away. Latency and errors can be
+injected, at start-up or at runtime by POSTing JSON such as
+``{"latency": 2, "error_rate": 0.5, "fail_next": 3, "fail_status": 401}``
+to ``/__stub/faults``.
+Point FLUTTERWAVE_BASE_URL at ``<url>/v3`` and STRIPE_API_BASE at ``<url>``
+to use it.
+"""
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+VERIFY_RE = re.compile(r"^/v3/transactions/(\d+)/verify$")
+SESSION_RE = re.compile(r"^/v1/checkout/sessions/([\w-]+)$")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up mid-response, which is expected here.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class GatewayStub:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, fail_next=0, fail_status=503):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_next = fail_next
+        self.fail_status = fail_status
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.payments = {}
+        self.sessions = {}
+        self.server = _Server((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def set_faults(self, latency=None, error_rate=None, fail_next=None, fail_status=None):
+        with self.lock:
+            if latency is not None:
+                self.latency = float(latency)
+            if error_rate is not None:
+                self.error_rate = float(error_rate)
+            if fail_next is not None:
+                self.fail_next = int(fail_next)
+            if fail_status is not None:
+                self.fail_status = int(fail_status)
+
+    def _inject_fault(self):
+        """Sleep for the configured latency; return True if this call should fail."""
+        with self.lock:
+            self.requests += 1
+            latency = self.latency
+            fail = self.fail_next > 0 or random.random() < self.error_rate
+            if self.fail_next > 0:
+                self.fail_next -= 1
+        if latency:
+            time.sleep(latency)
+        return fail
+
+    def _flutterwave_payment(self, payment):
+        return {"status": "success", "message": "Transaction fetched successfully", "data": payment}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _fail(self, path):
+                if path.startswith("/v1/"):
+                    return self._send(stub.fail_status, {"error": {"type": "api_error", "message": "Injected failure"}})
+                return self._send(stub.fail_status, {"status": "error", "message": "Injected failure"})
+
+            def _body(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    return json.loads(raw or b"{}")
+                return {key: values[-1] for key, values in parse_qs(raw.decode()).items()}
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                body = self._body()
+                if path == "/__stub/faults":
+                    stub.set_faults(**body)
+                    return self._send(200, {"latency": stub.latency, "error_rate": stub.error_rate})
+                if stub._inject_fault():
+                    return self._fail(path)
+
+                if path == "/v3/payments":
+                    transaction_id = next(stub.ids)
+                    stub.payments[transaction_id] = {
+                        "id": transaction_id,
+                        "tx_ref": body.get("tx_ref"),
+                        "amount": float(body.get("amount", 0)),
+                        "currency": body.get("currency"),
+                        "status": "successful",
+                    }
+                    link = f"{stub.url}/checkout/{transaction_id}"
+                    return self._send(200, {"status": "success", "message": "Hosted Link", "data": {"link": link}})
+
+                if path == "/v1/checkout/sessions":
+                    session_id = f"cs_test_{next(stub.ids)}"
+                    stub.sessions[session_id] = {
+                        "id": session_id,
+                        "object": "checkout.session",
+                        "url": f"{stub.url}/checkout/{session_id}",
+                        "client_reference_id": body.get("client_reference_id"),
+                        "amount_total": int(body.get("line_items[0][price_data][unit_amount]", 0)),
+                        "currency": body.get("line_items[0][price_data][currency]"),
+                        "payment_status": "paid",
+                        "status": "complete",
+                    }
+                    return self._send(200, stub.sessions[session_id])
+                self._send(404, {"status": "error", "message": "Not found"})
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/__stub/stats":
+                    return self._send(200, {"requests": stub.requests})
+                if stub._inject_fault():
+                    return self._fail(url.path)
+
+                match = VERIFY_RE.match(url.path)
+                if match:
+                    payment = stub.payments.get(int(match.group(1)))
+                    if payment is None:
+                        return self._send(404, {"status": "error", "message": "No transaction was found for this id"})
+                    return self._send(200, stub._flutterwave_payment(payment))
+
+                if url.path == "/v3/transactions/verify_by_reference":
+                    tx_ref = parse_qs(url.query).get("tx_ref", [None])[0]
+                    for payment in stub.payments.values():
+                        if payment["tx_ref"] == tx_ref:
+                            return self._send(200, stub._flutterwave_payment(payment))
+                    return self._send(404, {"status": "error", "message": "No transaction was found for this reference"})
+
+                match = SESSION_RE.match(url.path)
+                if match and match.group(1) in stub.sessions:
+                    return self._send(200, stub.sessions[match.group(1)])
+                self._send(404, {"status": "error", "message": "Not found"})
+
+        return Handler
@@ -0,0 +1,108 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+
+def _claim(user, endpoint, key, fingerprint):
+    """Insert the key for this request; returns ``(record, created)``.
+
+    ``record`` is None if another request released the key between our
+    insert failing and the read, in which case the caller tries again.
+    """
+    try:
+        with db_transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, endpoint=endpoint, key=key, fingerprint=fingerprint), True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first(), False
+
+
+def _replay(record):
+    response = Response(record.response, status=record.status_code)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(endpoint):
+    """Honour an ``Idempotency-Key`` header on a POST view.
+
+    The first request with a key runs the view and stores its response;
+    repeats of the key within IDEMPOTENCY_KEY_TTL get that response back
+    without the view running again. A repeat that arrives while the first is
+    still running waits up to IDEMPOTENCY_WAIT_TIMEOUT for it to finish.
+    Server errors are not stored, so the client may retry them with the
+    same key. Keys are scoped to the user and ``endpoint``.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            if len(key) > 255:
+                return Response({"error": f"{HEADER} must be at most 255 characters"}, status=status.HTTP_400_BAD_REQUEST)
+
+            fingerprint = hashlib.sha256(request.body).hexdigest()
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+            while True:
+                record, created = _claim(request.user, endpoint, key, fingerprint)
+                if created:
+                    break
+                if record is None:
+                    continue
+
+                now = timezone.now()
+                if record.completed_at is not None and record.created_at < now - settings.IDEMPOTENCY_KEY_TTL:
+                    # Expired but not purged yet: the key is free for reuse.
+                    IdempotencyKey.objects.filter(pk=record.pk).delete()
+                    continue
+                if record.fingerprint != fingerprint:
+                    return Response(
+                        {"error": f"{HEADER} was already used with a different request"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record.completed_at is not None:
+                    return _replay(record)
+                if record.created_at < now - settings.IDEMPOTENCY_LOCK_TIMEOUT:
+                    # The request that claimed the key died without releasing it.
+                    IdempotencyKey.objects.filter(pk=record.pk, completed_at__isnull=True).delete()
+                    continue
+                if time.monotonic() >= deadline:
+                    return Response(
+                        {"error": f"A request with this {HEADER} is still in progress"},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                record.status_code = response.status_code
+                record.response = response.data
+                record.completed_at = timezone.now()
+                record.save(update_fields=["status_code", "response", "completed_at"])
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def purge_expired_keys():
+    cutoff = timezone.now() - settings.IDEMPOTENCY_KEY_TTL
+    return IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()[0]
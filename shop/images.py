@@ -0,0 +1,122 @@
+import hashlib
+import re
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .cache import bump_catalog_version
+from .models import Product
+
+DERIVATIVE_DIR = "img/derivatives"
+
+# Matches "<stem>.<content hash>.<size>.<format>" derivative file names.
+DERIVATIVE_NAME_RE = re.compile(r"\.[0-9a-f]{12}\.[a-z]+\.(webp|jpeg)$")
+
+# Longest side, in pixels, of each derivative, smallest first. Images are
+# never upscaled: sizes beyond the original reuse its full-size variant.
+DERIVATIVES = {
+    "thumbnail": 160,
+    "card": 480,
+    "detail": 1200,
+}
+
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def needs_derivatives(product):
+    return bool(product.image) and product.image_variants.get("source") != product.image.name
+
+
+def _flatten(image):
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def generate_derivatives(product, force=False):
+    """Write the resized WebP/JPEG variants of ``product.image`` to storage.
+
+    Derivative names embed a hash of the original's bytes, so a replaced
+    image never reuses a cached URL. Returns False when nothing was done.
+    """
+    if not product.image or (not force and not needs_derivatives(product)):
+        return False
+
+    name = product.image.name
+    storage = product.image.storage
+    with storage.open(name, "rb") as original:
+        data = original.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem = PurePosixPath(name).stem
+
+    source = Image.open(BytesIO(data))
+    source = _flatten(ImageOps.exif_transpose(source))
+
+    variants = {}
+    full_size = None
+    for label, size in DERIVATIVES.items():
+        if full_size is not None:
+            variants[label] = full_size
+            continue
+        resized = source.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        entry = {"width": resized.width, "height": resized.height}
+        for extension, (pil_format, options) in FORMATS.items():
+            path = f"{DERIVATIVE_DIR}/{stem}.{digest}.{label}.{extension}"
+            if force or not storage.exists(path):
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, **options)
+                if storage.exists(path):
+                    storage.delete(path)
+                path = storage.save(path, ContentFile(buffer.getvalue()))
+            entry[extension] = path
+        variants[label] = entry
+        if size >= max(source.size):
+            full_size = entry
+
+    # update() rather than save() so the Product signals do not fire again.
+    product.image_variants = {"source": name, "variants": variants}
+    Product.objects.filter(pk=product.pk).update(image_variants=product.image_variants)
+    bump_catalog_version()
+    return True
+
+
+def derivative_urls(product, request=None):
+    """Return per-size URLs and ``srcset`` strings for ``product``'s image.
+
+    Returns None until the derivatives have been generated, in which case
+    clients should fall back to the original ``image`` URL.
+    """
+    variants = product.image_variants.get("variants") if product.image_variants else None
+    if not variants or product.image_variants.get("source") != product.image.name:
+        return None
+
+    storage = product.image.storage
+
+    def url(path):
+        location = storage.url(path)
+        return request.build_absolute_uri(location) if request is not None else location
+
+    result = {}
+    srcset = {extension: [] for extension in FORMATS}
+    widths = set()
+    for label, entry in variants.items():
+        result[label] = {"width": entry["width"], "height": entry["height"]}
+        listed = entry["width"] in widths
+        widths.add(entry["width"])
+        for extension in FORMATS:
+            location = url(entry[extension])
+            result[label][extension] = location
+            # Each width once: a srcset with repeated descriptors is invalid.
+            if not listed:
+                srcset[extension].append(f"{location} {entry['width']}w")
+    result["srcset"] = {extension: ", ".join(items) for extension, items in srcset.items()}
+    return result
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import images
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnail/card/detail WebP and JPEG derivatives for product images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerate derivatives that already exist")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        generated = failed = 0
+        for product in Product.objects.exclude(image="").iterator(chunk_size=200):
+            try:
+                if images.generate_derivatives(product, force=options["force"]):
+                    generated += 1
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"Product {product.pk} ({product.image.name}): {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated derivatives for {generated} products ({failed} failed) in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,112 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop import search
+from shop.cache import bump_catalog_version
+from shop.models import Product
+from shop.slugs import SlugAllocator
+from shop.tasks import rebuild_similar_products, schedule
+
+CATEGORIES = {value.lower(): value for value, _ in Product.CATEGORY}
+
+
+def read_rows(stream, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = "Bulk import products from a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSONL file to import, or - for stdin")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: from file extension)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk_create (default: 1000)")
+        parser.add_argument("--skip-similar", action="store_true", help="Do not queue a rebuild of the similar-products table")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        started = time.monotonic()
+        slugs = SlugAllocator.for_catalog()
+        imported = skipped = 0
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            rows = enumerate(read_rows(stream, fmt), start=1)
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                products = []
+                for number, row in chunk:
+                    try:
+                        products.append(self.build_product(row, slugs))
+                    except (KeyError, ValueError, InvalidOperation) as e:
+                        skipped += 1
+                        self.stderr.write(f"Row {number}: skipped ({e!r})")
+                with transaction.atomic():
+                    created = Product.objects.bulk_create(products)
+                    search.index_products(product.pk for product in created)
+                imported += len(created)
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"{imported} imported, {skipped} skipped ({imported / elapsed:.0f} rows/s)")
+        except (json.JSONDecodeError, csv.Error) as e:
+            raise CommandError(f"Could not parse {path}: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # bulk_create bypasses the Product signals, so refresh what they maintain.
+        if imported:
+            bump_catalog_version()
+            if not options["skip_similar"]:
+                schedule(rebuild_similar_products)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} products ({skipped} skipped) in {elapsed:.2f}s "
+            f"({imported / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+        if imported:
+            self.stdout.write("Run generate_image_derivatives to create thumbnails for the imported images.")
+
+    def build_product(self, row, slugs):
+        name = (row["name"] or "").strip()
+        if not name:
+            raise ValueError("name is required")
+        category = (row.get("category") or "").strip()
+        if category and category.lower() not in CATEGORIES:
+            raise ValueError(f"unknown category {category!r}")
+        price = Decimal(str(row["price"]))
+        slug = (row.get("slug") or "").strip()
+        if slug:
+            if slug in slugs.taken:
+                raise ValueError(f"slug {slug!r} already exists")
+            slugs.taken.add(slug)
+        else:
+            slug = slugs.allocate(name)
+        return Product(
+            name=name,
+            slug=slug,
+            price=price,
+            description=row.get("description") or None,
+            category=CATEGORIES.get(category.lower()) if category else None,
+            image=row.get("image") or "",
+        )
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import similarity
+from shop.models import SimilarProduct
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed similar-products table for the whole catalog"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        similarity.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {SimilarProduct.objects.count()} similar-product rows "
+            f"(k={similarity.get_k()}) in {time.monotonic() - started:.2f}s"
+        ))
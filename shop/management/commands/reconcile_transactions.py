@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.reconcile import reconcile_pending
+
+
+class Command(BaseCommand):
+    help = "Ask the payment gateways about pending transactions and settle the ones they have an answer for"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-age", type=int, help="Only transactions older than this many minutes (default: RECONCILE_MIN_AGE)")
+        parser.add_argument("--batch-size", type=int, help="Transactions per chunk (default: RECONCILE_BATCH)")
+        parser.add_argument("--workers", type=int, help="Concurrent gateway requests (default: RECONCILE_WORKERS)")
+        parser.add_argument("--limit", type=int, help="Stop after this many transactions")
+
+    def handle(self, *args, **options):
+        for name in ("batch_size", "workers", "limit"):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+        min_age = timedelta(minutes=options["min_age"]) if options["min_age"] is not None else None
+
+        stats = reconcile_pending(
+            min_age=min_age,
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            limit=options["limit"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {stats['checked']} pending transactions in {stats['seconds']:.2f}s "
+            f"({stats['per_second']:.1f}/s): {stats['completed']} completed, {stats['failed']} failed, "
+            f"{stats['abandoned']} abandoned, {stats['pending']} still pending, {stats['errors']} gateway errors, "
+            f"{stats['unknown']} with no gateway"
+        ))
@@ -0,0 +1,53 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from shop.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized item_count and subtotal of carts whose counters have drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Carts checked per query (default: 1000)")
+        parser.add_argument("--dry-run", action="store_true", help="Only report drifted carts")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        started = time.monotonic()
+        money = DecimalField(max_digits=12, decimal_places=2)
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            pks = list(Cart.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            checked += len(pks)
+            stale = list(
+                Cart.objects.filter(pk__in=pks)
+                .annotate(
+                    actual_count=Coalesce(Sum("items__quantity"), 0),
+                    actual_subtotal=Coalesce(
+                        Sum(F("items__quantity") * F("items__product__price"), output_field=money),
+                        Value(Decimal("0.00")),
+                        output_field=money,
+                    ),
+                )
+                .filter(~Q(actual_count=F("item_count")) | ~Q(actual_subtotal=F("subtotal")))
+                .values_list("pk", flat=True)
+            )
+            drifted += len(stale)
+            if stale and not options["dry_run"]:
+                Cart.objects.filter(pk__in=stale).recompute_totals()
+
+        verb = "Found" if options["dry_run"] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {drifted} drifted carts out of {checked} in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from shop.gateway_stub import GatewayStub
+
+
+class Command(BaseCommand):
+    help = "Run a local stub of the Flutterwave and Stripe APIs with optional injected latency and errors"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8089)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every response")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with a 503")
+
+    def handle(self, *args, **options):
+        stub = GatewayStub(options["host"], options["port"], latency=options["latency"], error_rate=options["error_rate"])
+        self.stdout.write(self.style.SUCCESS(f"Gateway stub listening on {stub.url}"))
+        self.stdout.write(f"  FLUTTERWAVE_BASE_URL={stub.url}/v3")
+        self.stdout.write(f"  STRIPE_API_BASE={stub.url}")
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server.server_close()
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+PG_DOCUMENT = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || "
+    "coalesce(description, '') || ' ' || coalesce(category, ''))"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+            "name, description, category, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO shop_product_fts(rowid, name, description, category) "
+            "SELECT id, name, coalesce(description, ''), coalesce(category, '') FROM shop_product"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS product_search_idx ON shop_product USING gin ({PG_DOCUMENT})"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON shop_product USING gin (name gin_trgm_ops)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_idx")
+        schema_editor.execute("DROP INDEX IF EXISTS product_name_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
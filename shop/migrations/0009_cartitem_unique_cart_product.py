@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    """Fold duplicate (cart, product) rows into the oldest one before the constraint is added."""
+    CartItem = apps.get_model("shop", "CartItem")
+    duplicates = (
+        CartItem.objects.values("cart_id", "product_id")
+        .annotate(rows=Count("id"), keep=Min("id"), total=Sum("quantity"))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        CartItem.objects.filter(pk=group["keep"]).update(quantity=group["total"])
+        CartItem.objects.filter(cart_id=group["cart_id"], product_id=group["product_id"]).exclude(pk=group["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_category_price_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='shop_cartitem_unique_cart_product'),
+        ),
+    ]
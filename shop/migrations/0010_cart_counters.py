@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:17
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_counters(apps, schema_editor):
+    Cart = apps.get_model("shop", "Cart")
+    CartItem = apps.get_model("shop", "CartItem")
+    lines = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+    money = DecimalField(max_digits=12, decimal_places=2)
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(total=Sum("quantity")).values("total")), 0),
+        subtotal=Coalesce(
+            Subquery(lines.annotate(total=Sum(F("quantity") * F("product__price"), output_field=money)).values("total")),
+            Value(Decimal("0.00")),
+            output_field=money,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_cartitem_unique_cart_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_counters, migrations.RunPython.noop),
+    ]
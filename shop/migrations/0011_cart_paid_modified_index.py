@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_cart_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['paid', 'modified_at'], name='cart_paid_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_cart_paid_modified_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='gateway',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='gateway_ref',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def backfill_orders(apps, schema_editor):
+    # Transactions completed before orders existed only have their carts to
+    # go on, so these lines carry the products' current prices.
+    Transaction = apps.get_model("shop", "Transaction")
+    CartItem = apps.get_model("shop", "CartItem")
+    Order = apps.get_model("shop", "Order")
+    OrderLine = apps.get_model("shop", "OrderLine")
+    pending = Transaction.objects.filter(status="completed").select_related("cart").order_by("id")
+    last = 0
+    while True:
+        transactions = list(pending.filter(id__gt=last)[:500])
+        if not transactions:
+            break
+        last = transactions[-1].id
+        items = defaultdict(list)
+        for item in CartItem.objects.filter(cart_id__in={t.cart_id for t in transactions}).select_related("product").order_by("id"):
+            items[item.cart_id].append(item)
+        orders = Order.objects.bulk_create([
+            Order(
+                transaction=t,
+                user_id=t.user_id,
+                cart_code=t.cart.cart_code,
+                item_count=sum(item.quantity for item in items[t.cart_id]),
+                subtotal=sum((item.quantity * item.product.price for item in items[t.cart_id]), start=0),
+                total=t.amount,
+                currency=t.currency.upper(),
+                created_at=t.modified_at,
+            )
+            for t in transactions
+        ])
+        OrderLine.objects.bulk_create([
+            OrderLine(
+                order=order,
+                product_id=item.product_id,
+                product_name=item.product.name,
+                product_slug=item.product.slug or "",
+                product_image=item.product.image.name or "",
+                unit_price=item.product.price,
+                quantity=item.quantity,
+            )
+            for order, t in zip(orders, transactions)
+            for item in items[t.cart_id]
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_code', models.CharField(max_length=11)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('currency', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='order', to='shop.transaction')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=100)),
+                ('product_slug', models.SlugField(blank=True, default='')),
+                ('product_image', models.CharField(blank=True, default='', max_length=255)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shop.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ),
+        migrations.RunPython(backfill_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:45
+
+from django.db import migrations
+from django.db.models import Q
+
+
+def backfill_gateway(apps, schema_editor):
+    # Rows from before 0012 have no gateway. The Stripe view stored checkout
+    # session ids ("cs_...") and a lowercase "usd"; everything else went
+    # through Flutterwave.
+    Transaction = apps.get_model("shop", "Transaction")
+    unknown = Transaction.objects.filter(gateway="")
+    unknown.filter(Q(gateway_ref__startswith="cs_") | Q(currency="usd")).update(gateway="stripe")
+    unknown.update(gateway="flutterwave")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_gateway, migrations.RunPython.noop),
+    ]
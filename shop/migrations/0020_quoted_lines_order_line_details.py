@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_line_details(apps, schema_editor):
+    # Existing lines only have their products to go on; lines whose product
+    # is gone keep the blank defaults.
+    OrderLine = apps.get_model("shop", "OrderLine")
+    Product = apps.get_model("shop", "Product")
+    product = Product.objects.filter(pk=OuterRef("product_id"))
+    OrderLine.objects.filter(product__isnull=False).update(
+        product_description=Coalesce(Subquery(product.values("description")[:1]), models.Value("")),
+        product_category=Coalesce(Subquery(product.values("category")[:1]), models.Value("")),
+        product_image_variants=Subquery(product.values("image_variants")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_stripeevent_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='product_category',
+            field=models.CharField(blank=True, default='', max_length=15),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='product_description',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='product_image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='quoted_lines',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(backfill_line_details, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,13 @@
-from django.db import models
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import DecimalField, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.text import slugify
 from account.models import CustomUser
+from .slugs import SlugAllocator
 
 class Product(models.Model):
     CATEGORY = (
@@ -18,20 +25,65 @@ class Product(models.Model):
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=15, choices=CATEGORY, blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["category", "id"], name="product_category_id_idx"),
+            models.Index(fields=["category", "price", "id"], name="product_category_price_idx"),
+        ]
 
     def __str__(self):
         return self.name
     
     def save(self, *args, **kwargs):
-     if not self.slug:
-        self.slug = slugify(self.name) 
-        unique_slug = self.slug
-        counter = 1
-        while Product.objects.filter(slug=unique_slug).exists(): 
-            unique_slug = f'{self.slug}-{counter}'
-            counter += 1
-        self.slug = unique_slug
-     super().save(*args, **kwargs)
+        if not self.slug:
+            self.slug = SlugAllocator.for_base(slugify(self.name)).allocate(self.name)
+        super().save(*args, **kwargs)
+
+class SimilarProduct(models.Model):
+    product = models.ForeignKey(Product, related_name='similar_entries', on_delete=models.CASCADE)
+    similar = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "similar"], name="unique_similar_product"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "-score"], name="similar_product_score_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.similar_id} similar to {self.product_id} ({self.score:.3f})"
+
+class CartQuerySet(models.QuerySet):
+    def recompute_totals(self):
+        """Recompute ``item_count`` and ``subtotal`` from the items in one UPDATE.
+
+        Also bumps ``version``, so quotes cached for the old contents are not reused.
+        """
+        lines = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+        money = DecimalField(max_digits=12, decimal_places=2)
+        return self.update(
+            version=F("version") + 1,
+            item_count=Coalesce(Subquery(lines.annotate(total=Sum("quantity")).values("total")), 0),
+            subtotal=Coalesce(
+                Subquery(lines.annotate(total=Sum(F("quantity") * F("product__price"), output_field=money)).values("total")),
+                Value(Decimal("0.00")),
+                output_field=money,
+            ),
+        )
+
+    def abandoned(self, cutoff):
+        """Unpaid carts untouched since ``cutoff`` that never reached checkout."""
+        return self.filter(paid=False, modified_at__lt=cutoff, transactions__isnull=True)
+
+    def with_items(self):
+        return self.prefetch_related(
+            Prefetch("items", queryset=CartItem.objects.select_related("product").order_by("id"))
+        )
 
 class Cart(models.Model):
     cart_code = models.CharField(max_length=11, unique=True)
@@ -39,17 +91,92 @@ class Cart(models.Model):
     paid = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     modified_at = models.DateTimeField(auto_now=True, blank=True, null=True)
+    # Kept in step with the items in the same transaction as every CartItem
+    # write; repair_cart_counters recomputes them if they ever drift.
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"), editable=False)
+    # Bumped with the counters whenever the contents or their prices change;
+    # pricing keys cached quotes on it.
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["paid", "modified_at"], name="cart_paid_modified_idx"),
+        ]
 
     def __str__(self):
         return self.cart_code
 
+    @staticmethod
+    def adjust_totals(cart_id, quantity, price):
+        """Add ``quantity`` units at ``price`` to a cart's counters (negative to remove)."""
+        Cart.objects.filter(pk=cart_id).update(
+            version=F("version") + 1,
+            item_count=F("item_count") + quantity,
+            subtotal=F("subtotal") + quantity * price,
+        )
+
+    def sync_lines(self, quantities, existing=None):
+        """Make the cart's items match ``quantities`` ({product_id: quantity}).
+
+        Uses one bulk_create, one bulk_update and one delete whatever the
+        number of lines; ``existing`` may pass in already-loaded items keyed
+        by product id. Returns ``{product_id: item_id}`` for the kept lines.
+        """
+        if existing is None:
+            existing = {item.product_id: item for item in CartItem.objects.filter(cart=self)}
+        wanted = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        to_create = [
+            CartItem(cart=self, product_id=product_id, quantity=quantity)
+            for product_id, quantity in wanted.items()
+            if product_id not in existing
+        ]
+        to_update = []
+        for product_id, item in existing.items():
+            if product_id in wanted and item.quantity != wanted[product_id]:
+                item.quantity = wanted[product_id]
+                to_update.append(item)
+        stale = [item.pk for product_id, item in existing.items() if product_id not in wanted]
+
+        with transaction.atomic():
+            CartItem.objects.bulk_create(to_create)
+            CartItem.objects.bulk_update(to_update, ["quantity"])
+            CartItem.objects.filter(pk__in=stale).delete()
+            Cart.objects.filter(pk=self.pk).update(modified_at=timezone.now())
+            Cart.objects.filter(pk=self.pk).recompute_totals()
+
+        ids = {product_id: item.pk for product_id, item in existing.items() if product_id in wanted}
+        ids.update((item.product_id, item.pk) for item in to_create)
+        return ids
+
 class CartItem(models.Model):
     cart = models.ForeignKey('Cart', related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey('Product', on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="shop_cartitem_unique_cart_product"),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in cart {self.cart.id}"
+
+    def save(self, *args, **kwargs):
+        # Recomputed from the rows rather than adjusted by the change in
+        # quantity: increment_cart_item bumps the row without loading it,
+        # so the quantity this instance was loaded with may be stale.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Cart.objects.filter(pk=self.cart_id).recompute_totals()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            Cart.objects.filter(pk=self.cart_id).recompute_totals()
+            return deleted
     
 
 class Transaction(models.Model):
@@ -58,9 +185,102 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default='NGN')
     status = models.CharField(max_length=20, default='pending') # Can be pending, completed, failed
+    gateway = models.CharField(max_length=20, blank=True, default='') # flutterwave or stripe
+    # The gateway's own id for the payment: Flutterwave transaction id or Stripe checkout session id.
+    gateway_ref = models.CharField(max_length=255, blank=True, default='', db_index=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, blank=True, null=True)
+    # The quote's lines, [{product_id, quantity, unit_price}], that ``amount`` was charged for.
+    quoted_lines = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="transaction_status_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"Transaction {self.ref} - {self.status}"
+
+class Order(models.Model):
+    """What a completed transaction bought, as it was at the time of payment.
+
+    Written once by payments.complete_transactions and never recomputed, so
+    order history keeps the prices paid however the catalog changes.
+    """
+    transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='order')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, blank=True, null=True, related_name='orders')
+    cart_code = models.CharField(max_length=11)
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2)
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    currency = models.CharField(max_length=10)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"], name="order_user_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"Order {self.cart_code} ({self.total} {self.currency})"
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    # Kept when the product is deleted; the other product_* fields and the price are copies.
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    product_name = models.CharField(max_length=100)
+    product_slug = models.SlugField(blank=True, default='')
+    product_image = models.CharField(max_length=255, blank=True, default='')
+    product_image_variants = models.JSONField(default=dict, blank=True)
+    product_description = models.TextField(blank=True, default='')
+    product_category = models.CharField(max_length=15, blank=True, default='')
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name}"
+
+class StripeEvent(models.Model):
+    """Inbox of verified Stripe webhook events, drained by process_stripe_events."""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    stripe_created = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Set after a failed attempt; the event is not retried before then.
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["processed_at", "stripe_created"], name="stripe_event_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+class IdempotencyKey(models.Model):
+    """A client's Idempotency-Key for one endpoint and the response it got.
+
+    ``completed_at`` is null while the first request carrying the key is
+    still running.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "endpoint", "key"], name="unique_idempotency_key"),
+        ]
+
     def __str__(self):
-        return f"Transaction {self.ref} - {self.status}"
\ No newline at end of file
+        return f"{self.endpoint} {self.key}"
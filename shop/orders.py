@@ -0,0 +1,86 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from .models import CartItem, Order, OrderLine, Product, Transaction
+
+
+def _charged_lines(transaction, cart_items):
+    """``(product_id, quantity, unit_price)`` for what ``transaction`` charged."""
+    if transaction.quoted_lines:
+        return [(line["product_id"], line["quantity"], Decimal(line["unit_price"])) for line in transaction.quoted_lines]
+    # Transactions started before quotes kept their lines only have the cart.
+    return cart_items[transaction.cart_id]
+
+
+def _order_line(order, product, quantity, unit_price):
+    if product is None:
+        # Deleted after it was quoted; all that is left is what it cost.
+        return OrderLine(order=order, product_name="", unit_price=unit_price, quantity=quantity)
+    return OrderLine(
+        order=order,
+        product=product,
+        product_name=product.name,
+        product_slug=product.slug or "",
+        product_image=product.image.name or "",
+        product_image_variants=product.image_variants or {},
+        product_description=product.description or "",
+        product_category=product.category or "",
+        unit_price=unit_price,
+        quantity=quantity,
+    )
+
+
+def snapshot_orders(transaction_ids, created_at=None):
+    """Write an Order, with its lines, for each transaction that has none yet.
+
+    Lines take their quantities and unit prices from the quote the
+    transaction was charged for, so an order's subtotal and total agree with
+    the amount paid; names, images and descriptions are copied from the
+    products as they are now, so this must run when the transaction
+    completes. The transactions are locked first, which makes a second or
+    concurrent snapshot of the same transaction write nothing. Returns the
+    number of orders written.
+    """
+    created_at = created_at or timezone.now()
+    with db_transaction.atomic():
+        locked = list(Transaction.objects.select_for_update().filter(pk__in=transaction_ids).values_list("pk", flat=True))
+        transactions = list(
+            Transaction.objects.filter(pk__in=locked, order__isnull=True)
+            .select_related("cart")
+            .only("id", "amount", "currency", "user_id", "quoted_lines", "cart__cart_code")
+        )
+        if not transactions:
+            return 0
+
+        cart_items = defaultdict(list)
+        unquoted = {t.cart_id for t in transactions if not t.quoted_lines}
+        if unquoted:
+            rows = CartItem.objects.filter(cart_id__in=unquoted).order_by("id")
+            for cart_id, product_id, quantity, unit_price in rows.values_list("cart_id", "product_id", "quantity", "product__price"):
+                cart_items[cart_id].append((product_id, quantity, unit_price))
+        lines = {t.pk: _charged_lines(t, cart_items) for t in transactions}
+        products = Product.objects.in_bulk({product_id for charged in lines.values() for product_id, _, _ in charged})
+
+        orders = Order.objects.bulk_create([
+            Order(
+                transaction=t,
+                user_id=t.user_id,
+                cart_code=t.cart.cart_code,
+                item_count=sum(quantity for _, quantity, _ in lines[t.pk]),
+                subtotal=sum((quantity * unit_price for _, quantity, unit_price in lines[t.pk]), start=Decimal("0.00")),
+                total=t.amount,
+                currency=t.currency.upper(),
+                created_at=created_at,
+            )
+            for t in transactions
+        ])
+        OrderLine.objects.bulk_create([
+            _order_line(order, products.get(product_id), quantity, unit_price)
+            for order in orders
+            for product_id, quantity, unit_price in lines[order.transaction_id]
+        ])
+    return len(orders)
+
@@ -0,0 +1,141 @@
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def _reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith("-") else "-" + field for field in ordering)
+
+
+class KeysetCursorPagination(CursorPagination):
+    """CursorPagination whose position covers every field of the ordering.
+
+    DRF's cursor holds only the first ordering field and steps over ties in
+    it with an OFFSET. Here the cursor holds the whole row key, e.g.
+    ``(price, id)``, and a page starts with ``price > p OR (price = p AND
+    id > i)``, so every page is an indexed range scan however many rows
+    share a price. Orderings must end in a unique field.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        current_position = self.cursor.position if self.cursor is not None else None
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            queryset = queryset.filter(self._after(current_position, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = self._get_position_from_instance(results[-1], self.ordering) if has_following_position else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = current_position is not None, current_position
+            self.has_previous, self.previous_position = has_following_position, following_position
+        else:
+            self.has_next, self.next_position = has_following_position, following_position
+            self.has_previous, self.previous_position = current_position is not None, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _after(self, position, reverse):
+        """Rows that come after ``position`` in the (possibly reversed) ordering."""
+        values = position.split(",")
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        keyset = None
+        for field, value in reversed(list(zip(self.ordering, values))):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") != reverse else "gt"
+            past = Q(**{f"{name}__{lookup}": value})
+            keyset = past if keyset is None else past | (Q(**{name: value}) & keyset)
+        return keyset
+
+    def _get_position_from_instance(self, instance, ordering):
+        fields = [field.lstrip("-") for field in ordering]
+        if isinstance(instance, dict):
+            return ",".join(str(instance[name]) for name in fields)
+        return ",".join(str(getattr(instance, name)) for name in fields)
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    """Keyset pagination over the product table.
+
+    The page position is encoded in an opaque cursor, so fetching page N costs
+    the same indexed range scan as fetching page 1.
+    """
+
+    page_size = 24
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("id",)
+    ordering_query_param = "ordering"
+    orderings = {
+        "id": ("id",),
+        "-id": ("-id",),
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        requested = request.query_params.get(self.ordering_query_param)
+        return self.orderings.get(requested, self.ordering)
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    """Newest-first keyset pagination over a user's orders."""
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 50
+    ordering = ("-created_at", "-id")
+
+
+def wants_pagination(request):
+    params = request.query_params
+    return ProductCursorPagination.cursor_query_param in params or ProductCursorPagination.page_size_query_param in params
+
+
+def wants_stream(request):
+    return request.query_params.get("stream") in ("1", "true", "yes")
+
+
+def stream_json_list(queryset, serializer_class, context=None, chunk_size=500):
+    """Serialize ``queryset`` as a JSON array written incrementally.
+
+    Rows are read with ``.iterator()`` so neither the model instances nor the
+    rendered JSON for the whole queryset is ever held in memory at once.
+    """
+    context = context or {}
+
+    def generate():
+        yield "["
+        buffer = []
+        first = True
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            data = json.dumps(serializer_class(obj, context=context).data, cls=JSONEncoder)
+            buffer.append(data if first else "," + data)
+            first = False
+            if len(buffer) >= chunk_size:
+                yield "".join(buffer)
+                buffer = []
+        buffer.append("]")
+        yield "".join(buffer)
+
+    return StreamingHttpResponse(generate(), content_type="application/json")
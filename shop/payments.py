@@ -0,0 +1,148 @@
+import logging
+from decimal import Decimal
+
+import stripe
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cartstore import get_cart_store
+from .gateway import GatewayError, flutterwave, stripe_call
+from .models import Cart, Transaction
+from .orders import snapshot_orders
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def complete_transactions(transaction_ids):
+    """Mark transactions completed and their carts paid, in bulk and exactly once.
+
+    Safe to run concurrently with the callback, the verify task, webhooks
+    and reconciliation: rows are locked and only transactions that were not
+    already completed are touched. Each gets its Order snapshot in the same
+    database transaction. Returns the ids this call completed.
+    """
+    now = timezone.now()
+    with db_transaction.atomic():
+        rows = list(
+            Transaction.objects.select_for_update()
+            .filter(pk__in=transaction_ids)
+            .exclude(status=COMPLETED)
+            .values_list("pk", "cart_id")
+        )
+        if not rows:
+            return []
+        completed = [pk for pk, _ in rows]
+        cart_ids = {cart_id for _, cart_id in rows}
+        Transaction.objects.filter(pk__in=completed).update(status=COMPLETED, modified_at=now)
+        # update() rather than save(): the carts' counters may have moved since
+        # they were loaded, and this stays one query however many carts there are.
+        # A cart belongs to whoever paid for it.
+        payer = Transaction.objects.filter(pk__in=completed, cart=OuterRef("pk"), user__isnull=False).values("user")[:1]
+        Cart.objects.filter(pk__in=cart_ids).update(
+            paid=True,
+            user=Coalesce(Subquery(payer), F("user")),
+            modified_at=now,
+        )
+        snapshot_orders(completed, now)
+        cart_codes = list(Cart.objects.filter(pk__in=cart_ids).values_list("cart_code", flat=True))
+
+    store = get_cart_store()
+    if store is not None:
+        for cart_code in cart_codes:
+            store.evict(cart_code)
+    return completed
+
+
+def fail_transactions(transaction_ids):
+    return Transaction.objects.filter(pk__in=transaction_ids, status=PENDING).update(status=FAILED, modified_at=timezone.now())
+
+
+def mark_transaction_completed(transaction):
+    """Complete one transaction; returns True if this call completed it."""
+    completed = complete_transactions([transaction.pk])
+    transaction.status = COMPLETED
+    return bool(completed)
+
+
+def mark_transaction_failed(transaction):
+    fail_transactions([transaction.pk])
+    transaction.status = FAILED
+
+
+def _flutterwave_payment(response):
+    """The payment in a Flutterwave verify response, or None if Flutterwave has none."""
+    if response.status_code == 404:
+        return None
+    if not response.ok:
+        # A bad key or a broken gateway says nothing about the payment itself.
+        raise GatewayError(f"Flutterwave returned {response.status_code}", status_code=response.status_code)
+    body = response.json()
+    return body["data"] if body.get("status") == "success" else None
+
+
+def verify_flutterwave(transaction):
+    payment = None
+    if transaction.gateway_ref:
+        payment = _flutterwave_payment(flutterwave().get(f"transactions/{transaction.gateway_ref}/verify"))
+        if payment is not None and payment.get("tx_ref") != transaction.ref:
+            # The callback is unauthenticated, so its transaction id may be
+            # another payment's; only our own reference is trusted.
+            logger.warning("Flutterwave payment %s is not for transaction %s", transaction.gateway_ref, transaction.ref)
+            payment = None
+    if payment is None:
+        payment = _flutterwave_payment(flutterwave().get("transactions/verify_by_reference", params={"tx_ref": transaction.ref}))
+        if payment is not None and payment.get("tx_ref") != transaction.ref:
+            payment = None
+    if payment is None:
+        return PENDING
+    if payment["status"] == "successful":
+        matches = (
+            Decimal(str(payment["amount"])) == transaction.amount
+            and payment["currency"].upper() == transaction.currency.upper()
+        )
+        return COMPLETED if matches else FAILED
+    return FAILED if payment["status"] == "failed" else PENDING
+
+
+def verify_stripe(transaction):
+    if not transaction.gateway_ref:
+        return PENDING
+    session = stripe_call(stripe.checkout.Session.retrieve, transaction.gateway_ref)
+    if session.payment_status in ("paid", "no_payment_required"):
+        return COMPLETED
+    return FAILED if session.status == "expired" else PENDING
+
+
+VERIFIERS = {
+    "flutterwave": verify_flutterwave,
+    "stripe": verify_stripe,
+}
+
+
+def check_transaction(transaction):
+    """Ask the gateway how ``transaction`` went, without recording anything.
+
+    Returns PENDING, COMPLETED or FAILED, or None if the transaction's
+    gateway is unknown. Raises GatewayError if the gateway could not be
+    reached or answered with an error.
+    """
+    verifier = VERIFIERS.get(transaction.gateway)
+    return verifier(transaction) if verifier is not None else None
+
+
+def verify_transaction(transaction):
+    """Check a pending transaction with its gateway and record the outcome."""
+    if transaction.status != PENDING:
+        return transaction.status
+    outcome = check_transaction(transaction)
+    if outcome == COMPLETED:
+        mark_transaction_completed(transaction)
+    elif outcome == FAILED:
+        mark_transaction_failed(transaction)
+    return outcome
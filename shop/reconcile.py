@@ -0,0 +1,87 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import payments
+from .gateway import GatewayError
+from .models import Transaction
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_ERROR = "error"
+
+
+def _check(transaction):
+    try:
+        return transaction.pk, payments.check_transaction(transaction)
+    except GatewayError as e:
+        logger.warning("Reconciling transaction %s failed: %s", transaction.ref, e)
+        return transaction.pk, GATEWAY_ERROR
+
+
+def reconcile_pending(min_age=None, abandon_after=None, batch_size=None, workers=None, limit=None):
+    """Settle transactions left pending because the shopper never came back.
+
+    Walks pending transactions older than ``min_age`` in (created_at, id)
+    order, a chunk at a time, and asks their gateways for the outcome with
+    up to ``workers`` requests in flight. Each chunk's results are written
+    with bulk updates. Transactions the gateway still cannot settle after
+    ``abandon_after`` are marked failed; ones the gateway could not be
+    asked about never are. Returns counts and throughput.
+    """
+    min_age = settings.RECONCILE_MIN_AGE if min_age is None else min_age
+    abandon_after = abandon_after or settings.RECONCILE_ABANDON_AFTER
+    batch_size = batch_size or settings.RECONCILE_BATCH
+    workers = workers or settings.RECONCILE_WORKERS
+
+    started = time.monotonic()
+    now = timezone.now()
+    cutoff, abandon_cutoff = now - min_age, now - abandon_after
+    stats = {"checked": 0, "completed": 0, "failed": 0, "abandoned": 0, "pending": 0, "errors": 0, "unknown": 0}
+
+    pending = Transaction.objects.filter(status=payments.PENDING, created_at__lt=cutoff).order_by("created_at", "id")
+    last = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while limit is None or stats["checked"] < limit:
+            chunk = pending
+            if last is not None:
+                chunk = chunk.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1]))
+            size = batch_size if limit is None else min(batch_size, limit - stats["checked"])
+            transactions = list(chunk.only("id", "ref", "amount", "currency", "gateway", "gateway_ref", "created_at")[:size])
+            if not transactions:
+                break
+            last = (transactions[-1].created_at, transactions[-1].pk)
+            created = {transaction.pk: transaction.created_at for transaction in transactions}
+
+            completed, failed, abandoned = [], [], []
+            for pk, outcome in pool.map(_check, transactions):
+                if outcome == payments.COMPLETED:
+                    completed.append(pk)
+                elif outcome == payments.FAILED:
+                    failed.append(pk)
+                elif outcome == GATEWAY_ERROR:
+                    # Our failure to ask is no evidence the payment failed.
+                    stats["errors"] += 1
+                elif outcome is None:
+                    # No gateway recorded, so nobody was asked; leave it for a person.
+                    stats["unknown"] += 1
+                elif created[pk] < abandon_cutoff:
+                    abandoned.append(pk)
+                else:
+                    stats["pending"] += 1
+
+            stats["checked"] += len(transactions)
+            stats["completed"] += len(payments.complete_transactions(completed))
+            stats["failed"] += payments.fail_transactions(failed)
+            stats["abandoned"] += payments.fail_transactions(abandoned)
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["per_second"] = round(stats["checked"] / elapsed, 1) if elapsed else 0.0
+    logger.info("Reconciled %(checked)d pending transactions in %(seconds).3fs (%(per_second).1f/s)", stats)
+    return stats
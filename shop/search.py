@@ -0,0 +1,113 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+FTS_TABLE = "shop_product_fts"
+
+# Must match the expression of the product_search_idx GIN index created in
+# migration 0005, otherwise Postgres will not use the index.
+PG_DOCUMENT = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || "
+    "coalesce(description, '') || ' ' || coalesce(category, ''))"
+)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MAX_TERMS = 8
+INDEX_CHUNK_SIZE = 500
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def query_terms(query):
+    return TOKEN_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def search_products(query, limit=DEFAULT_LIMIT):
+    """Return up to ``limit`` products matching every term of ``query``.
+
+    Each term is matched as a prefix, and results are ordered by relevance
+    (matches in the name outrank matches in the category or description).
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    if connection.vendor == "sqlite":
+        ids = _sqlite_search(terms, limit)
+    elif connection.vendor == "postgresql":
+        ids = _postgres_search(terms, limit)
+    else:
+        return list(_fallback_search(terms)[:limit])
+
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+def _sqlite_search(terms, limit):
+    match = " ".join(f'"{term}"*' for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0, 2.0) LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _postgres_search(terms, limit):
+    tsquery = " & ".join(f"{term}:*" for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM shop_product WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s)) + similarity(name, %s) DESC, id "
+            f"LIMIT %s",
+            [tsquery, tsquery, " ".join(terms), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_search(terms):
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(description__icontains=term) | Q(category__icontains=term)
+    return Product.objects.filter(condition).order_by("id")
+
+
+def _chunks(ids):
+    # Keeps each statement well under SQLite's limit on bound parameters.
+    ids = list(ids)
+    for start in range(0, len(ids), INDEX_CHUNK_SIZE):
+        yield ids[start:start + INDEX_CHUNK_SIZE]
+
+
+def index_products(ids):
+    """Refresh the search index rows for the given product ids.
+
+    Postgres indexes an expression over the product columns, so it keeps
+    itself up to date and only SQLite's FTS5 table needs writing to.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(ids):
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, name, description, category) "
+                f"SELECT id, name, coalesce(description, ''), coalesce(category, '') "
+                f"FROM shop_product WHERE id IN ({placeholders})",
+                chunk,
+            )
+
+
+def remove_products(ids):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(ids):
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk)
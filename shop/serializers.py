@@ -1,21 +1,33 @@
 from rest_framework import serializers
-from .models import Product,Cart,CartItem 
+from .models import Product,Cart,CartItem,SimilarProduct,Order,OrderLine
+from django.core.files.storage import default_storage
+from . import images, similarity
 from django.contrib.auth import get_user_model
 class ProductSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Product
-        fields = ["id", "name", "slug", "image", "description", "category", "price"]
+        fields = ["id", "name", "slug", "image", "images", "description", "category", "price"]
+
+    def get_images(self, product):
+        return images.derivative_urls(product, self.context.get("request"))
 
 class DetailedProductSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
     similar_products = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ["id", "name", "price", "slug", "image", "description", "similar_products"]
+        fields = ["id", "name", "price", "slug", "image", "images", "description", "similar_products"]
+
+    def get_images(self, product):
+        return images.derivative_urls(product, self.context.get("request"))
 
     def get_similar_products(self, product):
-        products = Product.objects.filter(category=product.category).exclude(id=product.id)
-        serializer = ProductSerializer(products, many=True)
+        limit = self.context.get("similar_limit", similarity.get_k())
+        entries = SimilarProduct.objects.filter(product=product).select_related("similar").order_by("-score", "similar_id")[:limit]
+        serializer = ProductSerializer([entry.similar for entry in entries], many=True)
         return serializer.data
     
 class CartItemSerializer(serializers.ModelSerializer):
@@ -40,14 +52,30 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ["id", "cart_code", "items", "sum_total", "num_of_items", "created_at", "modified_at"]
 
     def get_sum_total(self, cart):
-        items = cart.items.all()
-        total = sum([item.product.price * item.quantity for item in items])
-        return total
+        return cart.subtotal
 
     def get_num_of_items(self, cart):
-        items = cart.items.all()
-        total = sum([item.quantity for item in items])
-        return total
+        return cart.item_count
+
+class QuoteLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+class QuoteSerializer(serializers.Serializer):
+    """A pricing quote, with its amounts as strings like the serializers' DecimalFields.
+
+    Quotes priced from Redis-only cart changes have only the amounts and currency.
+    """
+    cart_id = serializers.IntegerField(required=False)
+    version = serializers.IntegerField(required=False)
+    item_count = serializers.IntegerField(required=False)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    tax = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    currency = serializers.CharField()
+    lines = QuoteLineSerializer(many=True, required=False)
+    token = serializers.CharField(required=False)
 
 class SimpleCartSerializer(serializers.ModelSerializer):
     num_of_items=serializers.SerializerMethodField()
@@ -56,25 +84,62 @@ class SimpleCartSerializer(serializers.ModelSerializer):
         fields = ["id", "cart_code", "num_of_items"]
 
     def get_num_of_items(self, cart):
-        num_of_items = sum([item.quantity for item in cart.items.all()])
-        return num_of_items
+        return cart.item_count
     
-class NewCartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
-    order_id = serializers.SerializerMethodField()
-    order_date = serializers.SerializerMethodField()
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=["add", "set", "remove"])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if data["op"] == "set" and "quantity" not in data:
+            raise serializers.ValidationError({"quantity": "This field is required for set."})
+        data.setdefault("quantity", 1 if data["op"] == "add" else 0)
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    cart_code = serializers.CharField(max_length=11)
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    product = serializers.SerializerMethodField()
 
     class Meta:
-        model = CartItem
+        model = OrderLine
+        fields = ["id", "product", "quantity"]
+
+    def get_product(self, line):
+        # Same shape as ProductSerializer, from the copies taken at payment.
+        image = default_storage.url(line.product_image) if line.product_image else None
+        request = self.context.get("request")
+        if image and request is not None:
+            image = request.build_absolute_uri(image)
+        snapshot = Product(image=line.product_image, image_variants=line.product_image_variants)
+        return {
+            "id": line.product_id,
+            "name": line.product_name,
+            "slug": line.product_slug,
+            "image": image,
+            "images": images.derivative_urls(snapshot, request),
+            "description": line.product_description or None,
+            "category": line.product_category or None,
+            "price": str(line.unit_price),
+        }
+
+class OrderHistoryItemSerializer(OrderLineSerializer):
+    order_id = serializers.CharField(source="order.cart_code")
+    order_date = serializers.DateTimeField(source="order.created_at")
+
+    class Meta(OrderLineSerializer.Meta):
         fields = ["id", "product", "quantity", "order_id", "order_date"]
 
-    def get_order_id(self, cartitem):
-        order_id = cartitem.cart.cart_code
-        return order_id
+class OrderSerializer(serializers.ModelSerializer):
+    lines = OrderLineSerializer(many=True, read_only=True)
+    order_id = serializers.CharField(source="cart_code")
 
-    def get_order_date(self, cartitem):
-        order_date = cartitem.cart.modified_at
-        return order_date
+    class Meta:
+        model = Order
+        fields = ["id", "order_id", "created_at", "item_count", "subtotal", "total", "currency", "lines"]
 
 class UserSerializer(serializers.ModelSerializer):
     items=serializers.SerializerMethodField()
@@ -83,8 +148,13 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "first_name", "last_name", "email", "city", "country", "address", "phone","items"]
 
     def get_items(self, user):
-        cartitems = CartItem.objects.filter(cart__user=user, cart__paid=True)[:10]
-        serializer = NewCartItemSerializer(cartitems, many=True)
+        # One query over the order snapshots, at the prices actually paid.
+        lines = (
+            OrderLine.objects.filter(order__user=user)
+            .select_related("order")
+            .order_by("-order__created_at", "-order_id", "id")[:10]
+        )
+        serializer = OrderHistoryItemSerializer(lines, many=True, context=self.context)
         return serializer.data
 
 class CartCodeSerializer(serializers.ModelSerializer):
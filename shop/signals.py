@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import images, search, similarity
+from .cache import bump_catalog_version
+from .cartstore import get_cart_store
+from .models import Cart, Product, SimilarProduct
+from .tasks import generate_image_derivatives, schedule
+from .typeahead import typeahead_index
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(pre_save, sender=Product)
+def collect_scoring_key(sender, instance, raw=False, **kwargs):
+    instance._scoring_key = None
+    if not raw and instance.pk is not None:
+        row = Product.objects.filter(pk=instance.pk).values_list("name", "price", "category").first()
+        if row is not None:
+            instance._scoring_key = similarity.scoring_key(*row)
+
+
+@receiver(post_save, sender=Product)
+def update_similar_products(sender, instance, raw=False, **kwargs):
+    # Refreshing loads the whole category, so skip saves that leave every
+    # input to the scores alone, such as description or image edits.
+    if raw or instance._scoring_key == similarity.scoring_key(instance.name, instance.price, instance.category):
+        return
+    similarity.refresh_product(instance)
+
+
+@receiver(pre_delete, sender=Product)
+def collect_similar_products(sender, instance, **kwargs):
+    instance._listed_by = list(SimilarProduct.objects.filter(similar=instance).values_list("product_id", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def rebuild_similar_products(sender, instance, **kwargs):
+    similarity.rebuild_products(getattr(instance, "_listed_by", []))
+
+
+@receiver(post_save, sender=Product)
+def refresh_cart_totals(sender, instance, created, raw=False, **kwargs):
+    # Carts are priced at the current product price, so a price change has to
+    # reach the subtotals of the open carts holding the product.
+    if not created and not raw:
+        Cart.objects.filter(paid=False, items__product=instance).recompute_totals()
+
+
+@receiver(pre_delete, sender=Product)
+def collect_open_carts(sender, instance, **kwargs):
+    instance._open_carts = list(Cart.objects.filter(paid=False, items__product=instance).values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_open_cart_totals(sender, instance, **kwargs):
+    Cart.objects.filter(pk__in=getattr(instance, "_open_carts", [])).recompute_totals()
+
+
+# The catalog receivers are connected after the ones above so they run last,
+# and they bump the version on commit: bumping earlier would let a concurrent
+# request cache the old similar products or totals under the new version.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def update_typeahead_index(sender, instance, **kwargs):
+    pk, name, slug = instance.pk, instance.name, instance.slug
+    transaction.on_commit(lambda: typeahead_index.apply_change(pk, name, slug))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_typeahead_index(sender, instance, **kwargs):
+    # Read the pk now: the deletion clears it before the commit.
+    pk = instance.pk
+    transaction.on_commit(lambda: typeahead_index.apply_change(pk, deleted=True))
+
+
+@receiver(post_save, sender=Product)
+def schedule_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and images.needs_derivatives(instance):
+        transaction.on_commit(lambda: schedule(generate_image_derivatives, instance.pk))
+
+
+@receiver(post_save, sender=Cart)
+def evict_paid_cart(sender, instance, **kwargs):
+    store = get_cart_store()
+    if store is not None and instance.paid:
+        store.evict(instance.cart_code)
@@ -0,0 +1,189 @@
+import bisect
+import re
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+
+from .models import Product, SimilarProduct
+
+TOKEN_WEIGHT = 0.6
+PRICE_WEIGHT = 0.4
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+Entry = namedtuple("Entry", ["id", "tokens", "price"])
+
+
+def get_k():
+    return getattr(settings, "SIMILAR_PRODUCTS_K", 8)
+
+
+def name_tokens(name):
+    return frozenset(token for token in TOKEN_RE.findall((name or "").lower()) if len(token) > 1)
+
+
+def price_proximity(a, b):
+    high = max(a, b)
+    if high <= 0:
+        return 1.0
+    return 1.0 - abs(a - b) / high
+
+
+def scoring_key(name, price, category):
+    """What a product's similarity scores depend on."""
+    return name_tokens(name), float(price), category
+
+
+def _in_category(category, prefix=""):
+    if category is None:
+        return Q(**{f"{prefix}category__isnull": True})
+    return Q(**{f"{prefix}category": category})
+
+
+def score(a, b):
+    """Similarity of two entries from the same category, between 0 and 1."""
+    union = a.tokens | b.tokens
+    token_score = len(a.tokens & b.tokens) / len(union) if union else 0.0
+    return round(TOKEN_WEIGHT * token_score + PRICE_WEIGHT * price_proximity(a.price, b.price), 6)
+
+
+class CategoryIndex:
+    """All products of one category, indexed by name token and by price.
+
+    Category is the blocking key: products are only ever compared with
+    products of the same category.
+    """
+
+    def __init__(self, entries):
+        self.entries = {entry.id: entry for entry in entries}
+        self.by_price = sorted(self.entries.values(), key=lambda entry: (entry.price, entry.id))
+        self.prices = [entry.price for entry in self.by_price]
+        self.by_token = defaultdict(list)
+        for entry in self.entries.values():
+            for token in entry.tokens:
+                self.by_token[token].append(entry)
+
+    @classmethod
+    def load(cls, category):
+        products = Product.objects.filter(_in_category(category))
+        return cls(
+            Entry(pk, name_tokens(name), float(price))
+            for pk, name, price in products.values_list("id", "name", "price").iterator()
+        )
+
+    def candidates(self, entry, k):
+        # Products sharing no name token score on price alone, and that score
+        # falls with distance on either side, so the k nearest by price on each
+        # side are the only ones of them that can make the top k.
+        found = {}
+        for token in entry.tokens:
+            for other in self.by_token[token]:
+                found[other.id] = other
+        position = bisect.bisect_left(self.prices, entry.price)
+        for other in self.by_price[max(position - k - 1, 0):position + k + 1]:
+            found[other.id] = other
+        found.pop(entry.id, None)
+        return found.values()
+
+    def top_k(self, entry, k):
+        scored = sorted((-score(entry, other), other.id) for other in self.candidates(entry, k))
+        return [(other_id, -negative) for negative, other_id in scored[:k]]
+
+
+def _replace_rows(index, ids, k):
+    rows = []
+    for pk in ids:
+        entry = index.entries.get(pk)
+        if entry is None:
+            continue
+        rows.extend(SimilarProduct(product_id=pk, similar_id=other_id, score=value) for other_id, value in index.top_k(entry, k))
+    SimilarProduct.objects.filter(product_id__in=ids).delete()
+    SimilarProduct.objects.bulk_create(rows, batch_size=1000)
+
+
+def rebuild_products(ids):
+    """Recompute the similar-products list of each product in ``ids``."""
+    k = get_k()
+    by_category = defaultdict(list)
+    for pk, category in Product.objects.filter(id__in=list(ids)).values_list("id", "category"):
+        by_category[category].append(pk)
+    with transaction.atomic():
+        for category, category_ids in by_category.items():
+            _replace_rows(CategoryIndex.load(category), category_ids, k)
+
+
+def rebuild_all():
+    k = get_k()
+    categories = Product.objects.order_by().values_list("category", flat=True).distinct()
+    for category in list(categories):
+        index = CategoryIndex.load(category)
+        with transaction.atomic():
+            ids = list(index.entries)
+            for start in range(0, len(ids), 500):
+                _replace_rows(index, ids[start:start + 500], k)
+
+
+def refresh_product(product):
+    """Update the similar-products table after ``product`` was saved.
+
+    The product's own list is recomputed, and it is inserted into (or dropped
+    from) the lists of its peers without rescoring those peers from scratch.
+    """
+    k = get_k()
+    index = CategoryIndex.load(product.category)
+    entry = index.entries.get(product.pk)
+    if entry is None:
+        return
+
+    with transaction.atomic():
+        listed_by = dict(SimilarProduct.objects.filter(similar_id=product.pk).values_list("product_id", "score"))
+        SimilarProduct.objects.filter(Q(product_id=product.pk) | Q(similar_id=product.pk)).delete()
+
+        rows = [
+            SimilarProduct(product_id=product.pk, similar_id=other_id, score=value)
+            for other_id, value in index.top_k(entry, k)
+        ]
+        stats = {
+            row["product_id"]: (row["count"], row["lowest"])
+            for row in SimilarProduct.objects.filter(_in_category(product.category, "product__"))
+            .values("product_id")
+            .annotate(count=Count("id"), lowest=Min("score"))
+        }
+        rebuild = [pk for pk in listed_by if pk not in index.entries]
+        full = []
+        for other in index.entries.values():
+            if other.id == product.pk:
+                continue
+            value = score(other, entry)
+            previous = listed_by.get(other.id)
+            if previous is not None and value < previous:
+                # The product fell in this peer's ranking, so a product that
+                # was just outside its top k may now deserve the slot.
+                rebuild.append(other.id)
+                continue
+            count, lowest = stats.get(other.id, (0, None))
+            if count < k:
+                rows.append(SimilarProduct(product_id=other.id, similar_id=product.pk, score=value))
+            elif value > lowest:
+                rows.append(SimilarProduct(product_id=other.id, similar_id=product.pk, score=value))
+                full.append(other.id)
+        SimilarProduct.objects.bulk_create(rows, batch_size=1000)
+        _trim(full, k)
+
+    if rebuild:
+        rebuild_products(rebuild)
+
+
+def _trim(ids, k):
+    # In chunks, so the IN lists stay short however many peers there are.
+    for start in range(0, len(ids), 500):
+        kept = defaultdict(int)
+        excess = []
+        rows = SimilarProduct.objects.filter(product_id__in=ids[start:start + 500]).order_by("product_id", "-score", "similar_id")
+        for row_id, product_id in rows.values_list("id", "product_id"):
+            kept[product_id] += 1
+            if kept[product_id] > k:
+                excess.append(row_id)
+        SimilarProduct.objects.filter(id__in=excess).delete()
@@ -0,0 +1,40 @@
+from django.utils.text import slugify
+
+# For names with nothing slugify keeps, such as "!!!" or most non-Latin scripts.
+FALLBACK_BASE = "product"
+
+
+class SlugAllocator:
+    """Hands out unique product slugs without a query per collision.
+
+    Existing slugs are loaded once; suffixes continue from the last one
+    handed out for each base, the same "<base>-<n>" scheme Product.save uses.
+    """
+
+    def __init__(self, taken=()):
+        self.taken = set(taken)
+        self.next_suffix = {}
+
+    @classmethod
+    def for_base(cls, base):
+        from .models import Product
+
+        base = base or FALLBACK_BASE
+        return cls(Product.objects.filter(slug__startswith=base).values_list("slug", flat=True))
+
+    @classmethod
+    def for_catalog(cls):
+        from .models import Product
+
+        return cls(Product.objects.exclude(slug__isnull=True).values_list("slug", flat=True).iterator(chunk_size=5000))
+
+    def allocate(self, name):
+        base = slugify(name) or FALLBACK_BASE
+        slug = base
+        counter = self.next_suffix.get(base, 1)
+        while slug in self.taken:
+            slug = f"{base}-{counter}"
+            counter += 1
+        self.next_suffix[base] = counter
+        self.taken.add(slug)
+        return slug
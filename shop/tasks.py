@@ -0,0 +1,130 @@
+import logging
+import time
+from datetime import timedelta
+
+from celery import current_app, shared_task
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from . import idempotency, images, payments, reconcile, similarity, webhooks
+from .cartstore import get_cart_store
+from .gateway import GatewayError
+from .models import Cart, CartItem, Product, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+def schedule(task, *args, **kwargs):
+    """Queue ``task``, or log and skip it when there is no broker to queue it on."""
+    if not settings.CELERY_BROKER_URL and not current_app.conf.task_always_eager:
+        logger.warning("No Celery broker is configured; not scheduling %s", task.name)
+        return None
+    return task.delay(*args, **kwargs)
+
+
+@shared_task(ignore_result=True)
+def generate_image_derivatives(product_id, force=False):
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return
+    # A missing or unreadable upload will not fix itself on retry, and when
+    # tasks run eagerly an error here would fail the save that queued it.
+    try:
+        images.generate_derivatives(product, force=force)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning("Could not generate image derivatives for product %s (%s)", product.pk, product.image.name, exc_info=True)
+
+
+@shared_task(ignore_result=True)
+def rebuild_similar_products():
+    similarity.rebuild_all()
+
+
+@shared_task(ignore_result=True)
+def flush_cart_store():
+    store = get_cart_store()
+    if store is not None:
+        store.flush_dirty()
+
+
+@shared_task
+def reap_abandoned_carts(max_age_days=None, batch_size=None):
+    """Delete unpaid carts idle for longer than ABANDONED_CART_MAX_AGE.
+
+    Works through the carts in chunks, each deleted in its own short
+    transaction, and returns how many carts and items were removed.
+    """
+    started = time.monotonic()
+    max_age = timedelta(days=max_age_days) if max_age_days is not None else settings.ABANDONED_CART_MAX_AGE
+    batch_size = batch_size or settings.ABANDONED_CART_BATCH
+    cutoff = timezone.now() - max_age
+    store = get_cart_store()
+
+    carts = items = 0
+    while True:
+        chunk = dict(Cart.objects.abandoned(cutoff).order_by("modified_at").values_list("pk", "cart_code")[:batch_size])
+        if not chunk:
+            break
+        with transaction.atomic():
+            # Re-check the condition so a cart touched since the select survives.
+            pks = list(Cart.objects.abandoned(cutoff).filter(pk__in=chunk).values_list("pk", flat=True))
+            items += CartItem.objects.filter(cart_id__in=pks).delete()[0]
+            carts += Cart.objects.filter(pk__in=pks).delete()[1].get("shop.Cart", 0)
+        if store is not None:
+            for pk in pks:
+                store.evict(chunk[pk])
+        if len(chunk) < batch_size:
+            break
+
+    result = {"carts": carts, "items": items, "seconds": round(time.monotonic() - started, 3)}
+    logger.info("Reaped %(carts)d abandoned carts (%(items)d items) in %(seconds).3fs", result)
+    return result
+
+
+@shared_task(bind=True, max_retries=8)
+def verify_payment(self, transaction_id):
+    """Confirm a payment with its gateway, retrying with backoff until it settles.
+
+    Payments still pending when the retries run out (or straight away in
+    eager mode) are left for reconciliation.
+    """
+    transaction = Transaction.objects.select_related("cart").filter(pk=transaction_id).first()
+    if transaction is None:
+        return None
+    try:
+        outcome = payments.verify_transaction(transaction)
+    except GatewayError as e:
+        logger.warning("Verifying transaction %s failed: %s", transaction.ref, e)
+        outcome = None
+    if outcome in (payments.COMPLETED, payments.FAILED) or self.request.retries >= self.max_retries:
+        return outcome
+    if self.request.is_eager:
+        # Without a worker a retry would block the request that queued us.
+        return outcome
+    countdown = get_exponential_backoff_interval(factor=2, retries=self.request.retries, maximum=300, full_jitter=True)
+    raise self.retry(countdown=countdown)
+
+
+@shared_task
+def process_stripe_events():
+    """Drain the Stripe webhook inbox one batch at a time."""
+    totals = {"processed": 0, "failed": 0}
+    while True:
+        result = webhooks.process_events()
+        totals["processed"] += result["processed"]
+        totals["failed"] += result["failed"]
+        if result["processed"] + result["failed"] < settings.STRIPE_EVENT_BATCH:
+            return totals
+
+
+@shared_task
+def reconcile_transactions():
+    return reconcile.reconcile_pending()
+
+
+@shared_task
+def purge_idempotency_keys():
+    return idempotency.purge_expired_keys()
@@ -1,3 +1,1235 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import redis
+import requests
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  fakeredis needs it to run Lua scripts
+except ImportError:
+    fakeredis = None
+
+from account.models import CustomUser
+from shoppify import celery_app
+from . import facets, images, payments, pricing, search, similarity, views
+from .cache import bump_catalog_version, get_catalog_version
+from .cartstore import RedisCartStore
+from .gateway import CircuitBreaker, CircuitOpenError, GatewayClient, GatewayError
+from .gateway_stub import GatewayStub
+from .idempotency import idempotent
+from .models import Cart, CartItem, Order, OrderLine, Product, SimilarProduct, StripeEvent, Transaction
+from .orders import snapshot_orders
+from .reconcile import reconcile_pending
+from .slugs import SlugAllocator
+from .tasks import process_stripe_events, reap_abandoned_carts
+from .throttling import LocalBuckets, RedisBuckets
+from .typeahead import typeahead_index
+from .views import increment_cart_item
+
+
+@override_settings(TOKEN_BUCKETS={})
+class AddItemConcurrencyTests(TransactionTestCase):
+    threads = 8
+    requests_per_thread = 25
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="shopper", password="x")
+        self.cart = Cart.objects.create(cart_code="stress01", user=self.user)
+        self.products = [
+            Product.objects.create(name=f"Stress product {n}", price="9.99") for n in range(2)
+        ]
+
+    def hammer(self, product, errors):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            for _ in range(self.requests_per_thread):
+                response = client.post("/add_item/", {"cart_code": "stress01", "product_id": product.pk})
+                if response.status_code != 201:
+                    errors.append(response.content)
+        finally:
+            connection.close()
+
+    def test_concurrent_adds_lose_no_increments(self):
+        errors = []
+        workers = [
+            threading.Thread(target=self.hammer, args=(self.products[n % 2], errors))
+            for n in range(self.threads)
+        ]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        total = self.threads * self.requests_per_thread
+        self.assertEqual(errors, [])
+        lines = dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity"))
+        self.assertEqual(lines, {product.pk: total // 2 for product in self.products})
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.item_count, total)
+        # No lock waits or retries should be needed, so throughput stays in the
+        # same range as serial requests; this only catches pathological stalls.
+        self.assertGreater(total / elapsed, 20, f"{total} adds took {elapsed:.2f}s")
+
+
+@override_settings(TOKEN_BUCKETS={})
+class BatchCartItemsTests(TransactionTestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Batch product", price="3.00")
+
+    def batch(self, cart_code, client=None):
+        client = client or APIClient()
+        operations = [{"op": "add", "product_id": self.product.pk, "quantity": 1}]
+        return client.post("/cart/batch/", {"cart_code": cart_code, "operations": operations}, format="json")
+
+    def test_batches_racing_add_item_on_a_new_line_lose_nothing(self):
+        user = CustomUser.objects.create_user(username="racer", password="pw")
+        Cart.objects.create(cart_code="racing", user=user)
+        errors = []
+
+        def work(n):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for _ in range(10):
+                    if n % 2:
+                        response = self.batch("racing", client)
+                    else:
+                        response = client.post("/add_item/", {"cart_code": "racing", "product_id": self.product.pk})
+                    if response.status_code not in (200, 201):
+                        errors.append(response.content)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.get(cart__cart_code="racing").quantity, 40)
+
+    def test_paid_cart_is_rejected(self):
+        Cart.objects.create(cart_code="paidbatch", paid=True)
+        self.assertEqual(self.batch("paidbatch").status_code, 400)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis with Lua support is not installed")
+    def test_paid_cart_is_rejected_by_the_cart_store_too(self):
+        Cart.objects.create(cart_code="paidstore", paid=True)
+        store = RedisCartStore(fakeredis.FakeRedis(decode_responses=True))
+        with mock.patch("shop.views.get_cart_store", return_value=store):
+            self.assertEqual(self.batch("paidstore").status_code, 400)
+
+
+class UpdateQuantityTests(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name="Mug", price=Decimal("4.00"))
+        self.cart = Cart.objects.create(cart_code="qtycart")
+        self.item = CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def update(self, quantity):
+        return APIClient().patch("/update_quantity/", {"item_id": self.item.pk, "quantity": quantity}, format="json")
+
+    def test_negative_quantity_is_rejected(self):
+        response = self.update(-3)
+        self.assertEqual(response.status_code, 400)
+        self.item.refresh_from_db()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.cart.item_count, self.cart.subtotal), (2, 2, Decimal("8.00")))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis with Lua support is not installed")
+    def test_negative_quantity_is_rejected_by_the_cart_store_too(self):
+        store = RedisCartStore(fakeredis.FakeRedis(decode_responses=True))
+        with mock.patch("shop.views.get_cart_store", return_value=store):
+            self.assertEqual(self.update(-3).status_code, 400)
+        self.assertEqual(store.lines("qtycart"), {})
+
+    def test_updates_totals(self):
+        self.assertEqual(self.update(5).status_code, 200)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (5, Decimal("20.00")))
+
+    def test_save_after_a_concurrent_increment_keeps_totals_in_step(self):
+        item = CartItem.objects.get(pk=self.item.pk)
+        increment_cart_item(self.cart, self.item.product)
+        item.quantity = 5
+        item.save()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (5, Decimal("20.00")))
+
+    def test_delete_after_a_concurrent_increment_empties_totals(self):
+        item = CartItem.objects.get(pk=self.item.pk)
+        increment_cart_item(self.cart, self.item.product)
+        item.delete()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (0, Decimal("0.00")))
+
+
+class ProductsInCartTests(TestCase):
+    def setUp(self):
+        self.mug = Product.objects.create(name="Mug", price=Decimal("4.00"))
+        self.pen = Product.objects.create(name="Pen", price=Decimal("1.00"))
+        self.cart = Cart.objects.create(cart_code="membercart")
+        CartItem.objects.create(cart=self.cart, product=self.mug, quantity=3)
+
+    def lookup(self, product_ids, cart_code="membercart"):
+        return APIClient().get("/products_in_cart", {"cart_code": cart_code, "product_ids": product_ids})
+
+    def test_reports_membership_and_quantities_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.lookup(f"{self.mug.pk},{self.pen.pk},{self.mug.pk},999999")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "cart_code": "membercart",
+            "products": {
+                str(self.mug.pk): {"in_cart": True, "quantity": 3},
+                str(self.pen.pk): {"in_cart": False, "quantity": 0},
+                "999999": {"in_cart": False, "quantity": 0},
+            },
+        })
+
+    def test_paid_or_unknown_carts_hold_nothing(self):
+        self.assertEqual(self.lookup(str(self.mug.pk), cart_code="nosuchcart").json()["products"][str(self.mug.pk)]["quantity"], 0)
+        Cart.objects.filter(pk=self.cart.pk).update(paid=True)
+        self.assertEqual(self.lookup(str(self.mug.pk)).json()["products"][str(self.mug.pk)]["quantity"], 0)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.lookup("1,two").status_code, 400)
+        self.assertEqual(self.lookup("").status_code, 400)
+        self.assertEqual(self.lookup("1", cart_code="").status_code, 400)
+        too_many = ",".join(str(n) for n in range(1, views.MAX_MEMBERSHIP_IDS + 2))
+        self.assertEqual(self.lookup(too_many).status_code, 400)
+        self.assertEqual(self.lookup(too_many[:too_many.rindex(",")]).status_code, 200)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis with Lua support is not installed")
+    def test_reads_from_the_cart_store(self):
+        store = RedisCartStore(fakeredis.FakeRedis(decode_responses=True))
+        store.load("membercart")
+        store.set("membercart", self.pen.pk, 2)
+        with mock.patch("shop.views.get_cart_store", return_value=store):
+            products = self.lookup(f"{self.mug.pk},{self.pen.pk}").json()["products"]
+        self.assertEqual(products[str(self.mug.pk)], {"in_cart": True, "quantity": 3})
+        self.assertEqual(products[str(self.pen.pk)], {"in_cart": True, "quantity": 2})
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis with Lua support is not installed")
+class RedisCartStoreTests(TransactionTestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.store = self.new_store()
+        self.product = Product.objects.create(name="Store product", price="4.00")
+
+    def new_store(self):
+        return RedisCartStore(fakeredis.FakeRedis(server=self.server, decode_responses=True))
+
+    def run_threads(self, target, count):
+        errors = []
+
+        def run(n):
+            try:
+                target(n)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_first_loads_create_one_cart_and_keep_every_add(self):
+        def add(n):
+            store = self.new_store()
+            store.load("newcart", create=True)
+            store.add("newcart", self.product.pk)
+
+        self.run_threads(add, 8)
+        self.assertEqual(Cart.objects.filter(cart_code="newcart").count(), 1)
+        self.assertEqual(self.store.quantity("newcart", self.product.pk), 8)
+
+    def test_flushes_racing_adds_lose_nothing(self):
+        self.store.load("busy", create=True)
+
+        def work(n):
+            store = self.new_store()
+            for _ in range(25):
+                if n % 2:
+                    store.flush("busy", wait=True)
+                else:
+                    store.add("busy", self.product.pk)
+
+        self.run_threads(work, 6)
+        self.assertTrue(self.store.flush("busy", wait=True))
+        cart = Cart.objects.get(cart_code="busy")
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, 75)
+        self.assertEqual(cart.item_count, 75)
+
+    def test_waiting_flush_writes_changes_made_while_it_waited(self):
+        self.store.load("waiter", create=True)
+        self.store.add("waiter", self.product.pk)
+        self.store.client.set("cart:waiter:flushing", "someone-else")
+        waiter = threading.Thread(target=lambda: (self.new_store().flush("waiter", wait=True), connection.close()))
+        waiter.start()
+        time.sleep(0.05)
+        self.store.add("waiter", self.product.pk)
+        self.store.client.delete("cart:waiter:flushing")
+        waiter.join()
+        self.assertEqual(CartItem.objects.get(cart__cart_code="waiter").quantity, 2)
+
+    def test_lines_for_deleted_products_are_not_counted_or_flushed(self):
+        gone = Product.objects.create(name="Discontinued", price="1.00")
+        self.store.load("stale", create=True)
+        self.store.add("stale", self.product.pk, 2)
+        self.store.add("stale", gone.pk, 3)
+        gone.delete()
+        self.assertEqual(self.store.item_count("stale")[1], 2)
+        self.assertTrue(self.store.flush("stale"))
+        self.assertEqual(list(CartItem.objects.filter(cart__cart_code="stale").values_list("quantity", flat=True)), [2])
+
+    def test_paid_cart_is_not_loaded(self):
+        Cart.objects.create(cart_code="paidcart", paid=True)
+        self.assertIsNone(self.store.load("paidcart", create=True))
+
+    def test_flush_after_payment_leaves_the_paid_cart_alone(self):
+        self.store.load("paying", create=True)
+        self.store.add("paying", self.product.pk, 2)
+        self.assertTrue(self.store.flush("paying"))
+        # Paid, but not yet evicted, when a flush_dirty picks the cart up.
+        self.store.add("paying", self.product.pk, 5)
+        Cart.objects.filter(cart_code="paying").update(paid=True)
+        self.assertEqual(self.store.flush_dirty(), 0)
+        self.assertEqual(CartItem.objects.get(cart__cart_code="paying").quantity, 2)
+        self.assertIsNone(self.store.snapshot("paying"))
+        self.assertEqual(self.store.client.smembers("cart:dirty"), set())
+
+    def test_delete_with_a_malformed_product_id_is_not_found(self):
+        self.store.load("deleting", create=True)
+        with mock.patch("shop.views.get_cart_store", return_value=self.store):
+            response = APIClient().post("/delete_cartitem/", {"cart_code": "deleting", "product_id": "abc"})
+        self.assertEqual(response.status_code, 404)
+
+
+class SlugTests(TestCase):
+    def test_names_without_slug_characters_get_a_fallback_base(self):
+        Product.objects.create(name="Lamp", price="1.00")
+        first = Product.objects.create(name="!!!", price="1.00")
+        second = Product.objects.create(name="???", price="1.00")
+        self.assertEqual((first.slug, second.slug), ("product", "product-1"))
+        self.assertEqual(SlugAllocator.for_base("").taken, {"product", "product-1"})
+
+
+class SearchIndexTests(TestCase):
+    @unittest.skipUnless(connection.vendor == "sqlite", "only SQLite keeps a separate search table")
+    def test_large_batches_are_indexed_in_chunks(self):
+        products = Product.objects.bulk_create(
+            [Product(name=f"Teapot {n}", price="1.00") for n in range(search.INDEX_CHUNK_SIZE * 2 + 1)]
+        )
+        with self.assertNumQueries(6):
+            search.index_products(product.pk for product in products)
+        last = search.INDEX_CHUNK_SIZE * 2
+        self.assertEqual([product.name for product in search.search_products("teapot 0")], ["Teapot 0"])
+        self.assertEqual([product.name for product in search.search_products(f"teapot {last}")], [f"Teapot {last}"])
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+        Product.objects.create(name="Desk Lamp", price=Decimal("20.00"))
+
+    def run_import(self, filename, content, *args):
+        path = f"{self.directory}/{filename}"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        stdout, stderr = StringIO(), StringIO()
+        with mock.patch("shop.management.commands.import_products.rebuild_similar_products") as rebuild:
+            call_command("import_products", path, *args, stdout=stdout, stderr=stderr)
+        return rebuild, stderr.getvalue()
+
+    def test_csv_import_allocates_slugs_and_skips_bad_rows(self):
+        rebuild, errors = self.run_import("products.csv", (
+            "name,price,category,slug,description\n"
+            "Desk Lamp,25.00,electronics,,Bright\n"
+            "Desk Lamp,26.00,Electronics,,\n"
+            "Floor lamp,40.00,,floor-lamp,\n"
+            "Second floor lamp,41.00,,floor-lamp,\n"
+            ",5.00,,,\n"
+            "Cheap lamp,cheap,,,\n"
+            "Odd lamp,5.00,Furniture,,\n"
+        ))
+        imported = Product.objects.exclude(name="Desk Lamp", price=Decimal("20.00")).order_by("id")
+        self.assertEqual(
+            list(imported.values_list("name", "slug", "price", "category")),
+            [
+                ("Desk Lamp", "desk-lamp-1", Decimal("25.00"), "Electronics"),
+                ("Desk Lamp", "desk-lamp-2", Decimal("26.00"), "Electronics"),
+                ("Floor lamp", "floor-lamp", Decimal("40.00"), None),
+            ],
+        )
+        self.assertEqual([line.split(":")[0] for line in errors.splitlines()], ["Row 4", "Row 5", "Row 6", "Row 7"])
+        rebuild.delay.assert_called_once_with()
+
+    def test_jsonl_import(self):
+        rows = [{"name": "Kettle", "price": 30}, {"name": "Toaster", "price": "45.50", "category": "ELECTRONICS"}, {"price": 1}]
+        rebuild, errors = self.run_import("products.jsonl", "\n".join(json.dumps(row) for row in rows) + "\n\n", "--skip-similar")
+        self.assertEqual(
+            list(Product.objects.filter(name__in=["Kettle", "Toaster"]).order_by("id").values_list("slug", "price", "category")),
+            [("kettle", Decimal("30.00"), None), ("toaster", Decimal("45.50"), "Electronics")],
+        )
+        self.assertIn("Row 3", errors)
+        rebuild.delay.assert_not_called()
+
+    def test_rows_are_created_in_batches_and_indexed(self):
+        content = "name,price\n" + "".join(f"Teacup {n},2.00\n" for n in range(5))
+        before = get_catalog_version()
+        with mock.patch.object(Product.objects, "bulk_create", wraps=Product.objects.bulk_create) as bulk_create:
+            self.run_import("cups.csv", content, "--batch-size", "2")
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [2, 2, 1])
+        self.assertEqual(get_catalog_version(), before + 1)
+        if connection.vendor == "sqlite":
+            self.assertEqual([product.name for product in search.search_products("teacup 4")], ["Teacup 4"])
+            self.assertEqual(len(search.search_products("teacup")), 5)
+
+    def test_unparseable_file_is_an_error(self):
+        with self.assertRaises(CommandError):
+            self.run_import("broken.jsonl", '{"name": "Kettle", "price": 30}\n{not json\n')
+
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Three rows share each price, so a cursor on price alone would have to skip ties.
+        for n in range(9):
+            Product.objects.create(name=f"Item {n}", price=Decimal(["3.00", "1.00", "2.00"][n % 3]))
+        self.client = APIClient()
+
+    def walk(self, url, link="next"):
+        ids, pages = [], 0
+        while url:
+            body = self.client.get(url).json()
+            ids.extend(product["id"] for product in body["results"])
+            url = body[link]
+            pages += 1
+        return ids, pages
+
+    def test_follows_next_links_through_tied_prices(self):
+        expected = list(Product.objects.order_by("price", "id").values_list("id", flat=True))
+        self.assertEqual(self.walk("/products?ordering=price&page_size=2"), (expected, 5))
+        expected = list(Product.objects.order_by("-price", "-id").values_list("id", flat=True))
+        self.assertEqual(self.walk("/products?ordering=-price&page_size=4"), (expected, 3))
+
+    def test_previous_links_walk_back(self):
+        url = "/products?ordering=price&page_size=2"
+        for _ in range(3):
+            last = self.client.get(url).json()
+            url = last["next"]
+        ids, _ = self.walk(last["previous"], link="previous")
+        expected = list(Product.objects.order_by("price", "id").values_list("id", flat=True))
+        self.assertEqual(ids, expected[2:4] + expected[:2])
+
+    def test_pages_after_the_first_use_the_keyset_not_an_offset(self):
+        first = self.client.get("/products?ordering=price&page_size=2").json()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first["next"])
+        sql = queries.captured_queries[-1]["sql"]
+        self.assertNotIn("OFFSET", sql)
+        self.assertIn('"price" >', sql)
+
+    def test_last_page_has_no_next_link(self):
+        body = self.client.get("/products?page_size=9").json()
+        self.assertEqual((len(body["results"]), body["next"], body["previous"]), (9, None, None))
+
+    def test_page_size_is_capped(self):
+        for n in range(100):
+            Product.objects.create(name=f"Extra {n}", price=Decimal("9.00"))
+        body = self.client.get("/products?page_size=500").json()
+        self.assertEqual(len(body["results"]), 100)
+        self.assertIsNotNone(body["next"])
+
+    def test_malformed_cursor_is_not_found(self):
+        # "p=1" names a price but no id to break ties with.
+        self.assertEqual(self.client.get("/products?ordering=price&cursor=cD0x").status_code, 404)
+
+    def test_stream_writes_every_product_in_order(self):
+        response = self.client.get("/products?stream=1&ordering=-price")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        body = json.loads(b"".join(response.streaming_content))
+        expected = list(Product.objects.order_by("-price", "-id").values_list("id", flat=True))
+        self.assertEqual([product["id"] for product in body], expected)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        # Catalog responses are cached per version, which these tests do not bump.
+        cache.clear()
+        for name, price, category in [
+            ("Radio", "10.00", "Electronics"),
+            ("Speaker", "20.00", "Electronics"),
+            ("Television", "100.00", "Electronics"),
+            ("Rice", "5.00", "Groceries"),
+            ("Olive oil", "50.00", "Groceries"),
+            ("Mystery box", "30.00", None),
+        ]:
+            Product.objects.create(name=name, price=Decimal(price), category=category)
+
+    def category_counts(self, result):
+        return {entry["value"]: entry["count"] for entry in result["categories"]}
+
+    def test_counts_and_histogram(self):
+        result = facets.compute_facets(Product.objects.all(), bucket_count=2)
+        self.assertEqual(result["total"], 6)
+        self.assertEqual(self.category_counts(result), {"Electronics": 3, "Groceries": 2, "Clothings": 0, "Phone": 0})
+        self.assertEqual((result["price"]["min"], result["price"]["max"]), ("5.00", "100.00"))
+        # The maximum price falls in the last bucket, not past it.
+        self.assertEqual(result["price"]["histogram"], [
+            {"min": "5.00", "max": "52.50", "count": 5},
+            {"min": "52.50", "max": "100.00", "count": 1},
+        ])
+
+    def test_single_price_puts_everything_in_the_first_bucket(self):
+        result = facets.compute_facets(Product.objects.filter(category="Groceries", price=5), bucket_count=3)
+        self.assertEqual([bucket["count"] for bucket in result["price"]["histogram"]], [1, 0, 0])
+
+    def test_empty_selection(self):
+        result = facets.compute_facets(Product.objects.none())
+        self.assertEqual((result["total"], result["price"]), (0, {"min": None, "max": None, "histogram": []}))
+        self.assertEqual(set(self.category_counts(result).values()), {0})
+
+    def test_endpoint_combines_filters(self):
+        response = APIClient().get("/products/facets/", {"category": "electronics", "min_price": 15, "max_price": 100, "buckets": 1})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["total"], 2)
+        self.assertEqual(self.category_counts(result)["Electronics"], 2)
+        self.assertEqual(result["price"]["histogram"], [{"min": "20.00", "max": "100.00", "count": 2}])
+
+    def browse(self, **params):
+        return [product["name"] for product in APIClient().get("/products/browse/", params).json()["results"]]
+
+    def test_browse_applies_the_same_filters(self):
+        self.assertEqual(self.browse(category="Groceries", max_price=10), ["Rice"])
+        self.assertEqual(sorted(self.browse(min_price=20, max_price=50)), ["Mystery box", "Olive oil", "Speaker"])
+        self.assertEqual(self.browse(min_price=60, max_price=10), [])
+
+    def test_invalid_filter_is_rejected(self):
+        self.assertEqual(APIClient().get("/products/facets/", {"min_price": "cheap"}).status_code, 400)
+        self.assertEqual(APIClient().get("/products/browse/", {"max_price": "cheap"}).status_code, 400)
+
+
+class SimilarProductsTests(TestCase):
+    def setUp(self):
+        self.lamp = Product.objects.create(name="Desk lamp", price="20.00", category="Electronics")
+        self.other = Product.objects.create(name="Floor lamp", price="25.00", category="Electronics")
+
+    def test_edits_that_do_not_affect_scores_skip_the_refresh(self):
+        with mock.patch("shop.similarity.refresh_product") as refresh:
+            self.lamp.description = "Now with a longer cable"
+            self.lamp.save()
+            refresh.assert_not_called()
+            self.lamp.price = "22.00"
+            self.lamp.save()
+            refresh.assert_called_once_with(self.lamp)
+
+    def test_refresh_does_not_list_every_id_in_the_category(self):
+        Product.objects.bulk_create(
+            [Product(name=f"Lamp shade {n}", price=n + 1, category="Electronics") for n in range(300)]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            similarity.refresh_product(self.lamp)
+        selects = [query["sql"] for query in queries.captured_queries if query["sql"].startswith("SELECT")]
+        self.assertLess(max(map(len, selects)), 1000)
+        self.assertEqual(SimilarProduct.objects.filter(product=self.lamp).count(), similarity.get_k())
+        self.assertTrue(SimilarProduct.objects.filter(product=self.other, similar=self.lamp).exists())
+
+
+class CatalogResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Cached lamp", price=Decimal("9.00"))
+        self.client = APIClient()
+
+    def test_etag_is_answered_with_304_without_queries(self):
+        first = self.client.get("/products")
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+        with self.assertNumQueries(0):
+            cached = self.client.get("/products")
+            not_modified = self.client.get("/products", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((cached.content, cached["ETag"]), (first.content, etag))
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_product_save_invalidates(self):
+        etag = self.client.get("/products")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed lamp"
+            self.product.save()
+        response = self.client.get("/products", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()[0]["name"], "Renamed lamp")
+
+    # The manifest storage needs collectstatic to have run.
+    @override_settings(STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    })
+    def test_browsable_api_html_is_not_cached(self):
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/products", HTTP_ACCEPT="text/html")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("text/html", response["Content-Type"])
+            self.assertNotIn("ETag", response)
+            self.assertTrue(queries.captured_queries)
+
+
+class CatalogVersionTests(TestCase):
+    def test_version_is_bumped_once_the_save_has_committed(self):
+        typeahead_index.build()
+        before = get_catalog_version()
+        seen = []
+        refresh = similarity.refresh_product
+
+        def record_and_refresh(product):
+            seen.append(get_catalog_version())
+            refresh(product)
+
+        with mock.patch("shop.similarity.refresh_product", side_effect=record_and_refresh):
+            with self.captureOnCommitCallbacks(execute=True):
+                product = Product.objects.create(name="Versioned lamp", price="9.00")
+                self.assertEqual(get_catalog_version(), before)
+
+        self.assertEqual(seen, [before])
+        self.assertEqual(get_catalog_version(), before + 1)
+        # The local index followed the bump instead of going stale.
+        self.assertEqual(typeahead_index.version, before + 1)
+        with self.assertNumQueries(0):
+            self.assertEqual([hit["id"] for hit in typeahead_index.suggest("versioned")], [product.pk])
+
+    def test_deletion_reaches_the_typeahead_index(self):
+        product = Product.objects.create(name="Doomed lamp", price="9.00")
+        typeahead_index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(typeahead_index.suggest("doomed"), [])
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, width, height):
+        buffer = BytesIO()
+        Image.new("RGB", (width, height), "teal").save(buffer, "PNG")
+        return SimpleUploadedFile("lamp.png", buffer.getvalue(), content_type="image/png")
+
+    def test_unreadable_upload_is_logged_not_raised_into_the_save(self):
+        with self.assertLogs("shop.tasks", "WARNING"):
+            with self.captureOnCommitCallbacks(execute=True):
+                product = Product.objects.create(
+                    name="Broken lamp", price="5.00", image=SimpleUploadedFile("broken.png", b"not a png"),
+                )
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+
+    def test_missing_upload_is_logged_not_raised_into_the_save(self):
+        with self.assertLogs("shop.tasks", "WARNING"):
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.create(name="Lost lamp", price="5.00", image="img/gone.png")
+
+    def test_sizes_beyond_the_original_reuse_its_full_size_variant(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Small lamp", price="5.00", image=self.upload(300, 200))
+        product.refresh_from_db()
+
+        variants = product.image_variants["variants"]
+        self.assertEqual(variants["thumbnail"]["width"], 160)
+        self.assertEqual(variants["card"]["width"], 300)
+        self.assertEqual(variants["detail"], variants["card"])
+        urls = images.derivative_urls(product)
+        self.assertEqual([entry.rsplit(" ", 1)[1] for entry in urls["srcset"]["webp"].split(", ")], ["160w", "300w"])
+
+    def test_without_a_broker_derivatives_are_skipped_and_logged(self):
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=False)
+        self.addCleanup(celery_app.conf.update, CELERY_TASK_ALWAYS_EAGER=True)
+        with self.assertLogs("shop.tasks", "WARNING") as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                product = Product.objects.create(name="Queued lamp", price="5.00", image=self.upload(300, 200))
+        self.assertIn("No Celery broker", logs.output[0])
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+
+
+class TypeaheadIndexTests(TransactionTestCase):
+    def setUp(self):
+        Product.objects.create(name="Brass kettle", price="20.00")
+        typeahead_index.build()
+
+    def suggest(self, query):
+        with self.assertNumQueries(0):
+            return [hit["name"] for hit in typeahead_index.suggest(query)]
+
+    def test_stale_index_is_served_while_it_rebuilds_in_the_background(self):
+        # A change this process did not apply itself, as another worker's
+        # save or an image derivative run would make.
+        Product.objects.bulk_create([Product(name="Brass teapot", price="30.00")])
+        bump_catalog_version()
+
+        self.assertEqual(self.suggest("brass"), ["Brass kettle"])
+        typeahead_index.rebuilding.join()
+        self.assertEqual(self.suggest("brass"), ["Brass kettle", "Brass teapot"])
+        self.assertEqual(typeahead_index.version, get_catalog_version())
+
+    def test_index_older_than_the_max_age_is_rebuilt_without_a_version_bump(self):
+        Product.objects.bulk_create([Product(name="Brass teapot", price="30.00")])
+        self.assertEqual(self.suggest("brass"), ["Brass kettle"])
+
+        with override_settings(TYPEAHEAD_MAX_AGE=0):
+            self.assertEqual(self.suggest("brass"), ["Brass kettle"])
+        typeahead_index.rebuilding.join()
+        self.assertEqual(self.suggest("brass"), ["Brass kettle", "Brass teapot"])
+
+
+class ReapAbandonedCartsTests(TestCase):
+    def test_reaps_only_old_unpaid_carts_without_transactions(self):
+        product = Product.objects.create(name="Reaper product", price="5.00")
+        old = timezone.now() - timedelta(days=45)
+        carts = {code: Cart.objects.create(cart_code=code) for code in ("old", "fresh", "paid", "checkout")}
+        for cart in carts.values():
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        Cart.objects.filter(cart_code="paid").update(paid=True)
+        Transaction.objects.create(ref="tx-reaper", cart=carts["checkout"], amount="15.00")
+        Cart.objects.exclude(cart_code="fresh").update(modified_at=old)
+
+        result = reap_abandoned_carts.delay(batch_size=1).get()
+
+        self.assertEqual((result["carts"], result["items"]), (1, 1))
+        self.assertEqual(set(Cart.objects.values_list("cart_code", flat=True)), {"fresh", "paid", "checkout"})
+
+
+class GatewayClientTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = GatewayStub().start()
+        self.addCleanup(self.stub.stop)
+
+    def client_for(self, **kwargs):
+        kwargs.setdefault("breaker", CircuitBreaker("stub", failure_threshold=3, reset_timeout=60))
+        return GatewayClient("stub", f"{self.stub.url}/v3", backoff=0.01, **kwargs)
+
+    def test_retries_idempotent_calls_through_transient_errors(self):
+        payment = self.client_for().post("payments", json={"tx_ref": "t1", "amount": "10.00", "currency": "USD"})
+        self.stub.set_faults(fail_next=2)
+        response = self.client_for(retries=2).get("transactions/1/verify")
+        self.assertEqual(payment.status_code, 200)
+        self.assertEqual(response.json()["data"]["tx_ref"], "t1")
+
+    def test_does_not_retry_posts_the_gateway_may_have_processed(self):
+        self.stub.set_faults(fail_next=1)
+        with self.assertRaises(GatewayError):
+            self.client_for(retries=2).post("payments", json={"tx_ref": "t2", "amount": "1"})
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_read_timeout_is_bounded(self):
+        self.stub.set_faults(latency=1)
+        started = time.monotonic()
+        with self.assertRaises(GatewayError):
+            self.client_for(retries=0, timeout=(1, 0.2)).get("transactions/1/verify")
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_circuit_opens_and_fails_fast(self):
+        self.stub.set_faults(error_rate=1)
+        client = self.client_for(retries=0)
+        for _ in range(3):
+            with self.assertRaises(GatewayError):
+                client.get("transactions/1/verify")
+        with self.assertRaises(CircuitOpenError):
+            client.get("transactions/1/verify")
+        self.assertEqual(self.stub.requests, 3)
+
+    def test_retries_count_once_against_the_breaker(self):
+        client = self.client_for(retries=2)
+        self.stub.set_faults(fail_next=3)
+        with self.assertRaises(GatewayError):
+            client.get("transactions/1/verify")
+        self.assertEqual((self.stub.requests, client.breaker.failures, client.breaker.state), (3, 1, "closed"))
+
+    def test_half_open_trial_is_released_when_the_call_blows_up(self):
+        client = self.client_for(retries=0, breaker=CircuitBreaker("stub", failure_threshold=1, reset_timeout=0.05))
+        self.stub.set_faults(fail_next=1)
+        with self.assertRaises(GatewayError):
+            client.get("transactions/1/verify")
+        time.sleep(0.06)
+        with mock.patch.object(client.session, "request", side_effect=RuntimeError("bug")):
+            with self.assertRaises(RuntimeError):
+                client.get("transactions/1/verify")
+        self.assertEqual(client.get("transactions/1/verify").status_code, 404)
+        self.assertEqual(client.breaker.state, "closed")
+
+    def test_broken_response_body_is_a_gateway_failure(self):
+        client = self.client_for(retries=1)
+        with mock.patch.object(client.session, "request", side_effect=requests.exceptions.ChunkedEncodingError("cut off")):
+            with self.assertRaises(GatewayError):
+                client.get("transactions/1/verify")
+        self.assertEqual(client.breaker.failures, 1)
+
+
+class VerifyFlutterwaveTests(TestCase):
+    def setUp(self):
+        self.stub = GatewayStub().start()
+        self.addCleanup(self.stub.stop)
+        client = GatewayClient("stub", f"{self.stub.url}/v3", retries=0, breaker=CircuitBreaker("stub", failure_threshold=100))
+        patcher = mock.patch("shop.payments.flutterwave", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cart = Cart.objects.create(cart_code="verify01")
+        self.transaction = Transaction.objects.create(
+            ref="tx-verify", cart=cart, amount="25.00", currency="USD", gateway="flutterwave", gateway_ref="7"
+        )
+        self.transaction.refresh_from_db()
+
+    def add_payment(self, transaction_id, tx_ref, amount=25.0, status="successful"):
+        self.stub.payments[transaction_id] = {
+            "id": transaction_id, "tx_ref": tx_ref, "amount": amount, "currency": "USD", "status": status,
+        }
+
+    def verify(self):
+        outcome = payments.verify_transaction(self.transaction)
+        self.transaction.refresh_from_db()
+        return outcome
+
+    def test_payment_for_the_transaction_completes_it(self):
+        self.add_payment(7, "tx-verify")
+        self.assertEqual(self.verify(), payments.COMPLETED)
+        self.assertTrue(self.transaction.cart.paid)
+
+    def test_another_transactions_payment_does_not_settle_it(self):
+        self.add_payment(7, "tx-someone-else")
+        with self.assertLogs("shop.payments", "WARNING"):
+            self.assertEqual(self.verify(), payments.PENDING)
+        self.assertEqual(self.transaction.status, "pending")
+
+    def test_falls_back_to_our_reference_when_the_callback_id_is_wrong(self):
+        self.add_payment(7, "tx-someone-else")
+        self.add_payment(8, "tx-verify")
+        with self.assertLogs("shop.payments", "WARNING"):
+            self.assertEqual(self.verify(), payments.COMPLETED)
+
+    def test_unknown_payment_id_leaves_the_transaction_pending(self):
+        self.assertEqual(self.verify(), payments.PENDING)
+        self.assertEqual(self.transaction.status, "pending")
+
+    def test_client_and_server_errors_leave_the_transaction_pending(self):
+        self.add_payment(7, "tx-verify")
+        for status_code in (401, 503):
+            self.stub.set_faults(fail_next=1, fail_status=status_code)
+            with self.assertRaises(GatewayError):
+                self.verify()
+            self.assertEqual(self.transaction.status, "pending")
+        self.assertEqual(self.verify(), payments.COMPLETED)
+
+
+class ReconcilePendingTests(TestCase):
+    def setUp(self):
+        self.stub = GatewayStub().start()
+        self.addCleanup(self.stub.stop)
+        client = GatewayClient("stub", f"{self.stub.url}/v3", retries=0, breaker=CircuitBreaker("stub", failure_threshold=100))
+        patcher = mock.patch("shop.payments.flutterwave", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_user(username="payer", password="x")
+
+    def pending(self, ref, age, gateway="flutterwave", user=None):
+        cart = Cart.objects.create(cart_code=ref[:11])
+        transaction = Transaction.objects.create(ref=ref, cart=cart, amount="10.00", currency="USD", gateway=gateway, user=user)
+        Transaction.objects.filter(pk=transaction.pk).update(created_at=timezone.now() - age)
+        return transaction
+
+    def add_payment(self, tx_ref, status):
+        transaction_id = len(self.stub.payments) + 1
+        self.stub.payments[transaction_id] = {
+            "id": transaction_id, "tx_ref": tx_ref, "amount": 10.0, "currency": "USD", "status": status,
+        }
+
+    def statuses(self):
+        return dict(Transaction.objects.values_list("ref", "status"))
+
+    def test_settles_stale_transactions_and_abandons_old_unpaid_ones(self):
+        paid = self.pending("tx-paid", timedelta(hours=1), user=self.user)
+        self.pending("tx-declined", timedelta(hours=1))
+        self.pending("tx-waiting", timedelta(hours=1))
+        self.pending("tx-gone", timedelta(days=3))
+        self.pending("tx-fresh", timedelta(minutes=1))
+        self.add_payment("tx-paid", "successful")
+        self.add_payment("tx-declined", "failed")
+
+        stats = reconcile_pending(batch_size=2, workers=2)
+
+        self.assertEqual(
+            {key: stats[key] for key in ("checked", "completed", "failed", "abandoned", "pending")},
+            {"checked": 4, "completed": 1, "failed": 1, "abandoned": 1, "pending": 1},
+        )
+        self.assertEqual(self.statuses(), {
+            "tx-paid": "completed", "tx-declined": "failed", "tx-waiting": "pending",
+            "tx-gone": "failed", "tx-fresh": "pending",
+        })
+        cart = Cart.objects.get(pk=paid.cart_id)
+        self.assertEqual((cart.paid, cart.user), (True, self.user))
+
+    def test_never_abandons_transactions_nobody_could_ask_about(self):
+        self.pending("tx-outage", timedelta(days=3))
+        self.pending("tx-nogateway", timedelta(days=3), gateway="")
+        self.stub.set_faults(error_rate=1)
+
+        with self.assertLogs("shop.reconcile", "WARNING"):
+            stats = reconcile_pending()
+
+        self.assertEqual((stats["errors"], stats["unknown"], stats["abandoned"]), (1, 1, 0))
+        self.assertEqual(set(self.statuses().values()), {"pending"})
+
+
+@override_settings(CHECKOUT_TAX=Decimal("5.00"), CHECKOUT_CURRENCY="USD")
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.pen = Product.objects.create(name="Pen", price=Decimal("1.25"))
+        self.pad = Product.objects.create(name="Pad", price=Decimal("3.10"))
+        self.cart = Cart.objects.create(cart_code="pricecart")
+        CartItem.objects.create(cart=self.cart, product=self.pen, quantity=4)
+        CartItem.objects.create(cart=self.cart, product=self.pad, quantity=1)
+        self.cart.refresh_from_db()
+
+    def test_quote_sums_the_lines_and_adds_tax(self):
+        quote = pricing.quote_cart(self.cart)
+        self.assertEqual(
+            (quote["item_count"], quote["subtotal"], quote["tax"], quote["total"], quote["currency"]),
+            (5, Decimal("8.10"), Decimal("5.00"), Decimal("13.10"), "USD"),
+        )
+        self.assertEqual(quote["lines"], [
+            {"product_id": self.pen.pk, "quantity": 4, "unit_price": "1.25"},
+            {"product_id": self.pad.pk, "quantity": 1, "unit_price": "3.10"},
+        ])
+
+    def test_quotes_are_cached_per_cart_version(self):
+        pricing.quote_cart(self.cart)
+        with self.assertNumQueries(0):
+            pricing.quote_cart(self.cart)
+        CartItem.objects.create(cart=self.cart, product=Product.objects.create(name="Ink", price=Decimal("2.00")))
+        self.cart.refresh_from_db()
+        self.assertEqual(pricing.quote_cart(self.cart)["subtotal"], Decimal("10.10"))
+
+    def test_signed_quote_is_accepted_back_only_for_the_same_contents(self):
+        quote = pricing.quote_cart(self.cart)
+        self.assertEqual(pricing.load_quote(quote["token"], self.cart)["total"], Decimal("13.10"))
+        self.assertIsNone(pricing.load_quote(quote["token"][:-2] + "xx", self.cart))
+        self.assertIsNone(pricing.load_quote("", self.cart))
+
+        item = CartItem.objects.get(cart=self.cart, product=self.pad)
+        item.quantity = 2
+        item.save()
+        self.cart.refresh_from_db()
+        self.assertIsNone(pricing.load_quote(quote["token"], self.cart))
+        self.assertEqual(pricing.checkout_quote(self.cart, quote["token"])["total"], Decimal("16.20"))
+
+    def test_quote_amounts_are_strings_and_cart_totals_stay_numbers(self):
+        body = APIClient().get("/get_cart", {"cart_code": "pricecart"}).json()
+        self.assertEqual(body["sum_total"], 8.1)
+        self.assertEqual([item["total"] for item in body["items"]], [5.0, 3.1])
+        quote = body["quote"]
+        self.assertEqual((quote["subtotal"], quote["tax"], quote["total"]), ("8.10", "5.00", "13.10"))
+        self.assertEqual(quote["lines"][1]["unit_price"], "3.10")
+
+
+class CartQueryCountTests(TestCase):
+    """The cart and checkout views cost the same queries whatever the cart holds."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="counter", password="pw", email="counter@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = [Product.objects.create(name=f"Part {n}", price=Decimal("2.50")) for n in range(20)]
+
+    def cart_of(self, size):
+        cart = Cart.objects.create(cart_code=f"count{size}", user=self.user)
+        for product in self.products[:size]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        return cart.cart_code
+
+    def assert_queries_per_size(self, queries, request):
+        for size in (1, 5, 20):
+            cart_code = self.cart_of(size)
+            with self.subTest(size=size), self.assertNumQueries(queries):
+                self.assertEqual(request(cart_code).status_code, 200)
+
+    def test_get_cart(self):
+        self.assert_queries_per_size(3, lambda code: self.client.get("/get_cart", {"cart_code": code}))
+
+    def test_get_cart_stat(self):
+        self.assert_queries_per_size(1, lambda code: self.client.get("/get_cart_stat", {"cart_code": code}))
+
+    def test_initiate_payment(self):
+        gateway = mock.Mock(status_code=200)
+        gateway.json.return_value = {"status": "success"}
+        with mock.patch("shop.views.flutterwave") as flutterwave:
+            flutterwave.return_value.post.return_value = gateway
+            self.assert_queries_per_size(3, lambda code: self.client.post("/initiate_payment/", {"cart_code": code}, format="json"))
+
+    def test_initiate_stripe_payment(self):
+        session = mock.Mock(id="cs_test", url="https://checkout.example/cs_test")
+        with mock.patch("shop.views.stripe_call", return_value=session):
+            self.assert_queries_per_size(4, lambda code: self.client.post("/payments/initiate/", {"cart_code": code}, format="json"))
+
+
+class IdempotencyTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="payer", password="pw")
+        self.calls = []
+        self.delay = 0
+        self.status = 201
+
+        @api_view(["POST"])
+        @idempotent("test")
+        def view(request):
+            self.calls.append(request.data)
+            time.sleep(self.delay)
+            return Response({"call": len(self.calls), "amount": request.data["amount"]}, status=self.status)
+
+        self.view = view
+
+    def post(self, body, key="key-1"):
+        request = APIRequestFactory().post("/pay/", body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, self.user)
+        return self.view(request)
+
+    def test_repeat_gets_the_stored_response(self):
+        first = self.post({"amount": "10"})
+        repeat = self.post({"amount": "10"})
+        self.assertEqual((repeat.status_code, repeat.data), (201, first.data))
+        self.assertEqual(repeat["Idempotent-Replayed"], "true")
+        self.assertEqual(len(self.calls), 1)
+
+        self.assertEqual(self.post({"amount": "10"}, key="key-2").data["call"], 2)
+
+    def test_same_key_with_a_different_body_is_rejected(self):
+        self.post({"amount": "10"})
+        response = self.post({"amount": "99"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_concurrent_first_use_runs_the_view_once(self):
+        self.delay = 0.3
+        responses = []
+
+        def send():
+            try:
+                responses.append(self.post({"amount": "10"}))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({(response.status_code, response.data["call"]) for response in responses}, {(201, 1)})
+        self.assertEqual(sorted(response.has_header("Idempotent-Replayed") for response in responses), [False, True, True])
+
+    def test_server_errors_are_not_stored(self):
+        self.status = 500
+        self.post({"amount": "10"})
+        self.status = 201
+        retry = self.post({"amount": "10"})
+        self.assertEqual((retry.status_code, retry.has_header("Idempotent-Replayed")), (201, False))
+        self.assertEqual(len(self.calls), 2)
+
+
+class OrderSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username="buyer", password="pw")
+        self.product = Product.objects.create(name="Desk fan", price="10.00", description="Quiet", category="Electronics")
+        cart = Cart.objects.create(cart_code="snapcart", user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        quote = pricing.quote_cart(Cart.objects.get(pk=cart.pk))
+        self.transaction = Transaction.objects.create(
+            ref="snap-1", cart=cart, amount=quote["total"], currency=quote["currency"], user=self.user,
+            gateway="stripe", quoted_lines=quote["lines"],
+        )
+
+    def test_lines_keep_the_quoted_prices(self):
+        self.product.price = "15.00"
+        self.product.save()
+        payments.complete_transactions([self.transaction.pk])
+
+        order = Order.objects.get(transaction=self.transaction)
+        line = order.lines.get()
+        self.assertEqual((line.unit_price, line.quantity), (Decimal("10.00"), 2))
+        self.assertEqual(order.subtotal, Decimal("20.00"))
+        self.assertEqual(order.total, pricing.price(order.subtotal)["total"])
+
+    def test_second_snapshot_writes_nothing(self):
+        payments.complete_transactions([self.transaction.pk])
+        self.assertEqual(snapshot_orders([self.transaction.pk]), 0)
+        self.assertEqual(OrderLine.objects.filter(order__transaction=self.transaction).count(), 1)
+
+    def test_user_info_items_keep_the_product_shape(self):
+        payments.complete_transactions([self.transaction.pk])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        product = client.get("/user_info").json()["items"][0]["product"]
+        self.assertEqual(set(product), {"id", "name", "slug", "image", "images", "description", "category", "price"})
+        self.assertEqual((product["description"], product["category"], product["price"]), ("Quiet", "Electronics", "10.00"))
+
+    def test_order_history_pages_through_orders_created_together(self):
+        ids = [self.transaction.pk]
+        for n in range(4):
+            cart = Cart.objects.create(cart_code=f"snapcart{n}", user=self.user)
+            ids.append(Transaction.objects.create(ref=f"snap-{n + 2}", cart=cart, amount="5.00", user=self.user).pk)
+        snapshot_orders(ids, created_at=timezone.now())
+        client = APIClient()
+        client.force_authenticate(self.user)
+        seen, url = [], "/orders/?page_size=2"
+        while url:
+            body = client.get(url).json()
+            seen.extend(order["id"] for order in body["results"])
+            url = body["next"]
+        self.assertEqual(seen, list(Order.objects.order_by("-id").values_list("id", flat=True)))
+
+
+class ProcessStripeEventsTests(TestCase):
+    def event(self, event_id, payload):
+        return StripeEvent.objects.create(
+            event_id=event_id, type="checkout.session.completed", payload=payload, stripe_created=timezone.now()
+        )
+
+    def test_applies_events(self):
+        cart = Cart.objects.create(cart_code="webhook01")
+        Transaction.objects.create(ref="tx-webhook", cart=cart, amount="10.00", gateway="stripe")
+        self.event("evt_paid", {"data": {"object": {"client_reference_id": "tx-webhook", "payment_status": "paid"}}})
+
+        self.assertEqual(process_stripe_events.delay().get(), {"processed": 1, "failed": 0})
+        self.assertTrue(Cart.objects.get(pk=cart.pk).paid)
+
+    def test_failing_events_are_retried_on_later_runs_with_backoff(self):
+        with self.settings(STRIPE_EVENT_BATCH=2):
+            for n in range(2):
+                self.event(f"evt_broken_{n}", {"malformed": True})
+            with self.assertLogs("shop.webhooks", "ERROR"):
+                self.assertEqual(process_stripe_events.delay().get(), {"processed": 0, "failed": 2})
+            self.assertEqual(process_stripe_events.delay().get(), {"processed": 0, "failed": 0})
+
+            event = StripeEvent.objects.get(event_id="evt_broken_0")
+            self.assertEqual(event.attempts, 1)
+            self.assertIsNone(event.processed_at)
+            self.assertGreater(event.next_attempt_at, timezone.now())
+
+            StripeEvent.objects.update(next_attempt_at=timezone.now())
+            with self.assertLogs("shop.webhooks", "ERROR"):
+                process_stripe_events.delay().get()
+            event.refresh_from_db()
+            self.assertEqual(event.attempts, 2)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_local_bucket_allows_burst_then_refills(self):
+        buckets = LocalBuckets()
+        results = [buckets.take("search", "ip:1", rate=2, burst=3, now=100.0) for _ in range(4)]
+        self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+        self.assertAlmostEqual(results[-1][1], 0.5)
+        self.assertTrue(buckets.take("search", "ip:1", rate=2, burst=3, now=100.5)[0])
+        self.assertTrue(buckets.take("search", "ip:2", rate=2, burst=3, now=100.5)[0])
+        self.assertEqual(buckets.rejections(), {"search": 1})
+
+    @unittest.skipIf(fakeredis is None, "fakeredis with Lua support is not installed")
+    def test_redis_buckets_are_shared_by_workers(self):
+        server = fakeredis.FakeServer()
+        workers = [RedisBuckets(fakeredis.FakeRedis(server=server)) for _ in range(4)]
+        allowed = []
+
+        def hammer(buckets):
+            for _ in range(10):
+                allowed.append(buckets.take("login", "ip:1", rate=0.001, burst=15)[0])
+
+        threads = [threading.Thread(target=hammer, args=(buckets,)) for buckets in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(allowed.count(True), 15)
+        self.assertEqual(workers[0].rejections(), {"login": 25})
+
+    def test_redis_outage_lets_requests_through(self):
+        buckets = RedisBuckets(redis.Redis(port=1, socket_connect_timeout=0.1))
+        with self.assertLogs("shop.throttling", "WARNING"):
+            self.assertEqual(buckets.take("search", "ip:1", rate=1, burst=1), (True, 0.0))
+
+
+@override_settings(TOKEN_BUCKETS={"search": {"rate": 0.001, "burst": 2}, "login": {"rate": 0.001, "burst": 2}})
+class ThrottledEndpointTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("shop.throttling._store", LocalBuckets())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_search_is_throttled_per_client(self):
+        client = APIClient()
+        codes = [client.get("/products/search/").status_code for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+        other = client.get("/products/search/", REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(other.status_code, 200)
+
+    def test_forwarded_for_header_does_not_pick_the_bucket(self):
+        client = APIClient()
+        codes = [
+            client.get("/products/search/", HTTP_X_FORWARDED_FOR=f"10.0.1.{n}").status_code
+            for n in range(3)
+        ]
+        self.assertEqual(codes, [200, 200, 429])
+
+    def test_search_ignores_a_stale_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer expired.or.garbage")
+        self.assertEqual(client.get("/products/search/", {"q": "lamp"}).status_code, 200)
+
+    def test_token_endpoint_is_throttled_before_checking_passwords(self):
+        client = APIClient()
+        credentials = {"username": "nobody", "password": "wrong"}
+        codes = [client.post("/token/", credentials).status_code for _ in range(3)]
+        self.assertEqual(codes, [401, 401, 429])
+        self.assertIn("Retry-After", client.post("/token/", credentials))
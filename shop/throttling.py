@@ -0,0 +1,162 @@
+"""Token-bucket throttles for the hot and expensive endpoints.
+
+Each client gets a bucket per scope holding up to ``burst`` tokens, refilled
+at ``rate`` tokens a second; a request takes one token or is rejected with a
+Retry-After of the time until the next one. Scopes are configured in
+TOKEN_BUCKETS. Buckets live in process memory unless THROTTLE_REDIS_URL is
+set, in which case all workers share them in Redis. Either way a check is a
+constant-time update of one bucket and never touches the database.
+"""
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] bucket, KEYS[2] rejection counters; ARGV rate, burst, now, scope.
+# Returns {allowed, seconds to wait}; the wait is a string because Redis
+# truncates Lua numbers to integers.
+TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "stamp")
+local tokens = tonumber(bucket[1]) or burst
+local stamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+    redis.call("HINCRBY", KEYS[2], ARGV[4], 1)
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "stamp", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+
+class LocalBuckets:
+    """Buckets in this process's memory, behind a lock.
+
+    Limits apply per worker process. The least recently used buckets are
+    dropped beyond ``max_buckets`` to bound memory.
+    """
+
+    def __init__(self, max_buckets=100_000):
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.rejected = Counter()
+
+    def take(self, scope, ident, rate, burst, now=None):
+        now = time.monotonic() if now is None else now
+        key = (scope, ident)
+        with self.lock:
+            tokens, stamp = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - stamp) * rate)
+            if tokens >= 1:
+                allowed, wait = True, 0.0
+                tokens -= 1
+            else:
+                allowed, wait = False, (1 - tokens) / rate
+                self.rejected[scope] += 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return allowed, wait
+
+    def rejections(self):
+        with self.lock:
+            return dict(self.rejected)
+
+
+class RedisBuckets:
+    """Buckets shared by every worker, updated atomically by a Lua script."""
+
+    REJECTIONS_KEY = "throttle:rejected"
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(TAKE_TOKEN)
+
+    def take(self, scope, ident, rate, burst, now=None):
+        now = time.time() if now is None else now
+        try:
+            allowed, wait = self.script(keys=[f"throttle:{scope}:{ident}", self.REJECTIONS_KEY], args=[rate, burst, now, scope])
+        except redis.RedisError:
+            # Losing the limiter must not take the endpoints down with it.
+            logger.warning("Throttle store unavailable, letting %s request through", scope, exc_info=True)
+            return True, 0.0
+        return bool(allowed), float(wait)
+
+    def rejections(self):
+        return {
+            (scope.decode() if isinstance(scope, bytes) else scope): int(count)
+            for scope, count in self.client.hgetall(self.REJECTIONS_KEY).items()
+        }
+
+
+_store = None
+
+
+def get_bucket_store():
+    global _store
+    if _store is None:
+        if settings.THROTTLE_REDIS_URL:
+            _store = RedisBuckets(redis.Redis.from_url(settings.THROTTLE_REDIS_URL))
+        else:
+            _store = LocalBuckets()
+    return _store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle a view with the TOKEN_BUCKETS entry named by ``scope``.
+
+    Authenticated users get a bucket each; anonymous clients are keyed by IP.
+    Scopes missing from TOKEN_BUCKETS are not throttled.
+    """
+
+    scope = None
+
+    def get_ident_key(self, request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return f"ip:{self.get_ident(request)}"
+
+    def allow_request(self, request, view):
+        config = settings.TOKEN_BUCKETS.get(self.scope)
+        if config is None:
+            return True
+        ident = self.get_ident_key(request)
+        allowed, self.retry_after = get_bucket_store().take(self.scope, ident, config["rate"], config["burst"])
+        if not allowed:
+            logger.debug("Throttled %s request from %s", self.scope, ident)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class SearchThrottle(TokenBucketThrottle):
+    scope = "search"
+
+
+class AddItemThrottle(TokenBucketThrottle):
+    scope = "add_item"
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = "login"
+
+    def get_ident_key(self, request):
+        # Nobody is authenticated yet when asking for a token.
+        return f"ip:{self.get_ident(request)}"
@@ -0,0 +1,157 @@
+import bisect
+import heapq
+from itertools import islice
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .cache import get_catalog_version
+from .models import Product
+from .search import TOKEN_RE
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+MAX_RANGE = 5000
+MAX_CHECKED = 300
+
+logger = logging.getLogger(__name__)
+
+
+def name_tokens(name):
+    return tuple(sorted(set(TOKEN_RE.findall((name or "").lower()))))
+
+
+class TypeaheadIndex:
+    """In-process prefix index over product names for autocomplete.
+
+    Holds a sorted list of ``(token, product_id)`` pairs, so a prefix lookup
+    is a binary search followed by a short scan. The index remembers the
+    catalog version it reflects and rebuilds itself when that goes stale or
+    is older than TYPEAHEAD_MAX_AGE, which is how changes made by other
+    workers reach this one. Rebuilds run in a background thread while
+    lookups keep using the old index, so a keystroke never waits on the
+    database once the index has been built.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.built_at = None
+        self.entries = []
+        self.products = {}
+        self.rebuilding = None
+
+    def build(self):
+        version = get_catalog_version()
+        products = {}
+        entries = []
+        for pk, name, slug in Product.objects.values_list("id", "name", "slug").iterator(chunk_size=2000):
+            tokens = name_tokens(name)
+            products[pk] = (name, slug, tokens, name.lower())
+            entries.extend((token, pk) for token in tokens)
+        entries.sort()
+        with self.lock:
+            self.entries, self.products, self.version = entries, products, version
+            self.built_at = time.monotonic()
+
+    def warm(self):
+        try:
+            self.build()
+        except DatabaseError:
+            # Tables may not exist yet (e.g. before the first migrate); the
+            # first lookup will build the index instead.
+            pass
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except DatabaseError:
+            logger.warning("Could not rebuild the typeahead index", exc_info=True)
+        finally:
+            connection.close()
+
+    def refresh(self):
+        """Rebuild the index in the background unless a rebuild is running."""
+        with self.lock:
+            if self.rebuilding is not None and self.rebuilding.is_alive():
+                return
+            self.rebuilding = threading.Thread(target=self._rebuild, name="typeahead-rebuild", daemon=True)
+            self.rebuilding.start()
+
+    def ensure_current(self):
+        if self.version is None:
+            # Nothing to serve yet, so this lookup has to wait for the index.
+            self.build()
+        elif self.version != get_catalog_version() or time.monotonic() - self.built_at > settings.TYPEAHEAD_MAX_AGE:
+            self.refresh()
+
+    def _remove(self, pk):
+        _, _, tokens, _ = self.products.pop(pk, (None, None, (), None))
+        for token in tokens:
+            position = bisect.bisect_left(self.entries, (token, pk))
+            if position < len(self.entries) and self.entries[position] == (token, pk):
+                del self.entries[position]
+
+    def apply_change(self, pk, name=None, slug=None, deleted=False):
+        """Apply one product change made in this process.
+
+        Called right after the change bumped the catalog version: if the
+        index was current up to the previous version it stays current, and
+        otherwise it is left for ``ensure_current`` to rebuild.
+        """
+        with self.lock:
+            current = get_catalog_version()
+            if self.version is None or self.version != current - 1:
+                return
+            self._remove(pk)
+            if not deleted:
+                tokens = name_tokens(name)
+                self.products[pk] = (name, slug, tokens, name.lower())
+                for token in tokens:
+                    bisect.insort(self.entries, (token, pk))
+            self.version = current
+
+    def _range(self, term):
+        start = bisect.bisect_left(self.entries, (term,))
+        end = bisect.bisect_left(self.entries, (term + "\uffff",), lo=start)
+        return start, end
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        terms = sorted(set(TOKEN_RE.findall(query.lower())))
+        if not terms:
+            return []
+        self.ensure_current()
+        normalized = " ".join(TOKEN_RE.findall(query.lower()))
+
+        with self.lock:
+            # Every term is a prefix. Intersect the id sets of the terms whose
+            # ranges are small enough to materialize, then check the remaining
+            # (very common) prefixes against a bounded number of candidates.
+            ranges = sorted((end - start, start, end, term) for term, (start, end) in zip(terms, map(self._range, terms)))
+            _, start, end, _ = ranges[0]
+            # Dicts keep token order, so exact-token matches are kept first.
+            intersecting = any(size <= MAX_RANGE for size, _, _, _ in ranges[1:])
+            cap = MAX_RANGE if intersecting else MAX_CHECKED
+            candidates = dict.fromkeys(pk for _, pk in self.entries[start:min(end, start + cap)])
+            unchecked = []
+            for size, start, end, term in ranges[1:]:
+                if size > MAX_RANGE:
+                    unchecked.append(term)
+                else:
+                    others = {pk for _, pk in self.entries[start:end]}
+                    candidates = {pk: None for pk in candidates if pk in others}
+            candidates = [
+                pk for pk in islice(candidates, MAX_CHECKED)
+                if all(any(token.startswith(term) for token in self.products[pk][2]) for term in unchecked)
+            ]
+            ranked = heapq.nsmallest(
+                limit,
+                ((not self.products[pk][3].startswith(normalized), len(self.products[pk][3]), pk) for pk in candidates),
+            )
+            return [{"id": pk, "name": self.products[pk][0], "slug": self.products[pk][1]} for _, _, pk in ranked]
+
+
+typeahead_index = TypeaheadIndex()
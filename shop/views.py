@@ -1,36 +1,92 @@
 from django.shortcuts import render
-from rest_framework.decorators import api_view, permission_classes
-from .models import Product,Cart,CartItem ,Transaction
-from .serializers import ProductSerializer,DetailedProductSerializer,CartSerializer,CartItemSerializer,SimpleCartSerializer,UserSerializer,CartCodeSerializer
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from .models import Product,Cart,CartItem ,Transaction,Order,OrderLine
+from .serializers import ProductSerializer,DetailedProductSerializer,CartSerializer,CartItemSerializer,SimpleCartSerializer,UserSerializer,CartCodeSerializer,CartBatchSerializer,OrderSerializer,QuoteSerializer
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.conf import settings
+from django.contrib.auth import get_user_model
+import json
 import uuid
-from decimal import Decimal
 from django.shortcuts import get_object_or_404
-import requests
 from rest_framework.views import APIView
 import stripe
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import F, Prefetch
+from . import facets, pricing, search, similarity, typeahead, webhooks
+from .cache import cached_catalog_response
+from .cartstore import get_cart_store
+from .filters import ProductFilter
+from .gateway import GatewayError, configure_stripe, flutterwave, stripe_call
+from .idempotency import idempotent
+from .pagination import OrderCursorPagination, ProductCursorPagination, stream_json_list, wants_pagination, wants_stream
+from .tasks import schedule, verify_payment
+from .throttling import AddItemThrottle, SearchThrottle, get_bucket_store
 
 
 BASE_URL = settings.FRONTEND_BASE_URL
 
-stripe.api_key=settings.STRIPE_SECRET_KEY
+configure_stripe()
 
 
+def product_list_response(request, products, context=None, status_code=status.HTTP_200_OK):
+    context = context or {}
+    if wants_stream(request):
+        paginator = ProductCursorPagination()
+        ordering = paginator.get_ordering(request, products, None)
+        return stream_json_list(products.order_by(*ordering), ProductSerializer, context=context)
+
+    if wants_pagination(request):
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(products, request)
+        serializer = ProductSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
+
+    serializer = ProductSerializer(products, many=True, context=context)
+    return Response(serializer.data, status=status_code)
+
+@cached_catalog_response("products")
 @api_view(["GET"])
 def products(request):
     products = Product.objects.all()
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    return product_list_response(request, products)
 
+@cached_catalog_response("browse_products")
+@api_view(["GET"])
+def browse_products(request):
+    filterset = ProductFilter(request.query_params, queryset=Product.objects.all())
+    if not filterset.is_valid():
+        return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+    paginator = ProductCursorPagination()
+    page = paginator.paginate_queryset(filterset.qs, request)
+    serializer = ProductSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
+@cached_catalog_response("product_facets")
+@api_view(["GET"])
+def product_facets(request):
+    filterset = ProductFilter(request.query_params, queryset=Product.objects.all())
+    if not filterset.is_valid():
+        return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        buckets = min(max(int(request.query_params.get("buckets", facets.DEFAULT_BUCKETS)), 1), facets.MAX_BUCKETS)
+    except ValueError:
+        buckets = facets.DEFAULT_BUCKETS
+    return Response(facets.compute_facets(filterset.qs, buckets))
+
+@cached_catalog_response("product_detail")
 @api_view(["GET"])
 def product_detail(request, slug):
     product = Product.objects.get(slug=slug)
-    serializer = DetailedProductSerializer(product)
+    k = similarity.get_k()
+    try:
+        similar_limit = min(max(int(request.query_params.get("similar", k)), 0), k)
+    except ValueError:
+        similar_limit = k
+    serializer = DetailedProductSerializer(product, context={"similar_limit": similar_limit})
     return Response(serializer.data)
 
 class CurrentUserCartCodeView(APIView):
@@ -47,7 +103,36 @@ class CurrentUserCartCodeView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def increment_cart_item(cart, product, quantity=1):
+    """Add ``quantity`` to a cart line without a read-modify-write cycle.
+
+    The increment is a single ``UPDATE ... SET quantity = quantity + n``;
+    if there is no line yet it is inserted, and an insert that loses the
+    race against the unique (cart, product) constraint falls back to the
+    update.
+    """
+    lines = CartItem.objects.filter(cart=cart, product=product)
+
+    def bump():
+        with db_transaction.atomic():
+            if not lines.update(quantity=F("quantity") + quantity):
+                return False
+            Cart.adjust_totals(cart.pk, quantity, product.price)
+            return True
+
+    if not bump():
+        try:
+            with db_transaction.atomic():
+                # batch_cart_items holds the cart lock while it rewrites the lines.
+                Cart.objects.select_for_update().filter(pk=cart.pk).values_list("pk").first()
+                return CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        except IntegrityError:
+            bump()
+    item_id, new_quantity = lines.values_list("id", "quantity").get()
+    return CartItem(id=item_id, cart=cart, product=product, quantity=new_quantity)
+
 @api_view(['POST'])
+@throttle_classes([AddItemThrottle])
 def add_item(request):
     try:
         cart_code = request.data.get("cart_code")
@@ -60,24 +145,26 @@ def add_item(request):
             )
             
         
-        cart, created = Cart.objects.get_or_create(cart_code=cart_code,user=request.user)
-        
-        
         try:
             product = Product.objects.get(id=product_id)
         except Product.DoesNotExist:
             return Response({"error": f"Product with id {product_id} not found"}, status=404)
         
+        store = get_cart_store()
+        if store is not None:
+            if store.load(cart_code, user_id=request.user.id, create=True) is None:
+                return Response({"error": "Cart has already been paid for"}, status=400)
+            quantity, item_id = store.add(cart_code, product.pk)
+            serializer = CartItemSerializer(CartItem(id=item_id, product=product, quantity=quantity))
+            return Response(
+                {"data": serializer.data, "message": "CartItem created successfully"}, 
+                status=201
+            )
         
-        cartitem, created = CartItem.objects.get_or_create(cart=cart, product=product)
+        cart, created = Cart.objects.get_or_create(cart_code=cart_code,user=request.user)
         
         
-        if not created:
-            cartitem.quantity += 1
-        else:
-            cartitem.quantity = 1
-            
-        cartitem.save()
+        cartitem = increment_cart_item(cart, product)
         
        
         serializer = CartItemSerializer(cartitem)
@@ -95,6 +182,12 @@ def product_in_cart(request):
     cart_code = request.query_params.get("cart_code")
     product_id = request.query_params.get("product_id")
 
+    store = get_cart_store()
+    if store is not None:
+        if store.load(cart_code) is None or not Product.objects.filter(id=product_id).exists():
+            return Response({'error': 'Cart or product not found'}, status=404)
+        return Response({'product_in_cart': store.quantity(cart_code, product_id) > 0})
+
     try:
         cart = Cart.objects.get(cart_code=cart_code)
         product = Product.objects.get(id=product_id)
@@ -105,19 +198,83 @@ def product_in_cart(request):
 
     return Response({'product_in_cart': product_exists_in_cart})
 
+MAX_MEMBERSHIP_IDS = 200
+
+@api_view(['GET'])
+def products_in_cart(request):
+    """Report, for many products at once, whether and how often each is in a cart."""
+    cart_code = request.query_params.get("cart_code")
+    try:
+        raw_ids = request.query_params.get("product_ids", "").split(",")
+        product_ids = list(dict.fromkeys(int(value) for value in raw_ids if value.strip()))
+    except ValueError:
+        return Response({"error": "product_ids must be a comma-separated list of integers"}, status=status.HTTP_400_BAD_REQUEST)
+    if not cart_code or not product_ids:
+        return Response({"error": "cart_code and product_ids are required"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(product_ids) > MAX_MEMBERSHIP_IDS:
+        return Response({"error": f"At most {MAX_MEMBERSHIP_IDS} product_ids per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+    store = get_cart_store()
+    if store is not None and store.load(cart_code) is not None:
+        quantities = store.quantities(cart_code, product_ids)
+    else:
+        quantities = dict.fromkeys(product_ids, 0)
+        quantities.update(
+            CartItem.objects.filter(cart__cart_code=cart_code, cart__paid=False, product_id__in=product_ids)
+            .values_list("product_id", "quantity")
+        )
+    return Response({
+        "cart_code": cart_code,
+        "products": {
+            str(product_id): {"in_cart": quantity > 0, "quantity": quantity}
+            for product_id, quantity in quantities.items()
+        },
+    })
+
 @api_view(['GET'])
 def get_cart_stat(request):
     cart_code = request.query_params.get("cart_code")
-    cart = Cart.objects.get(cart_code=cart_code, paid=False)
+    store = get_cart_store()
+    if store is not None:
+        cart_id, item_count = store.item_count(cart_code)
+        if cart_id is None:
+            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"id": cart_id, "cart_code": cart_code, "num_of_items": item_count})
+    cart = Cart.objects.only("id", "cart_code", "item_count").get(cart_code=cart_code, paid=False)
     serializer = SimpleCartSerializer(cart)
     return Response(serializer.data)
 
 @api_view(['GET'])
 def get_cart(request):
     cart_code = request.query_params.get("cart_code")
-    cart = Cart.objects.get(cart_code=cart_code, paid=False)
+    store = get_cart_store()
+    if store is not None:
+        cart = store.snapshot(cart_code)
+        if cart is None:
+            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        # Redis-only changes have no database version to sign yet; checkout
+        # flushes the cart and quotes it then.
+        return Response({**CartSerializer(cart).data, "quote": QuoteSerializer(pricing.price(cart.subtotal)).data})
+    cart = Cart.objects.with_items().get(cart_code=cart_code, paid=False)
     serializer = CartSerializer(cart)
-    return Response(serializer.data)
+    return Response({**serializer.data, "quote": QuoteSerializer(pricing.quote_cart(cart)).data})
+
+def store_cart_line(request):
+    """Resolve the ``(cart_code, product_id)`` a cart line request refers to.
+
+    With the Redis cart store, lines that have not been flushed yet have no
+    item id, so clients may send ``cart_code`` and ``product_id`` instead.
+    """
+    cart_code = request.data.get("cart_code")
+    product_id = request.data.get("product_id")
+    if cart_code and product_id:
+        try:
+            return cart_code, int(product_id)
+        except (TypeError, ValueError):
+            return None, None
+    item_id = request.data.get("item_id")
+    line = CartItem.objects.filter(id=item_id, cart__paid=False).values_list("cart__cart_code", "product_id").first()
+    return line or (None, None)
 
 @api_view(['PATCH'])
 def update_quantity(request):
@@ -125,6 +282,20 @@ def update_quantity(request):
         cartitem_id = request.data.get("item_id")
         quantity = request.data.get("quantity")
         quantity = int(quantity)
+        # CartItem.quantity has no CHECK constraint, so a negative count
+        # would be saved and taken off the cart's totals.
+        if quantity < 0:
+            return Response({"error": "quantity must be 0 or more"}, status=status.HTTP_400_BAD_REQUEST)
+        store = get_cart_store()
+        if store is not None:
+            cart_code, product_id = store_cart_line(request)
+            if cart_code is None or store.load(cart_code) is None:
+                return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+            product = Product.objects.get(id=product_id)
+            store.set(cart_code, product.pk, quantity)
+            _, item_id = store.lines(cart_code).get(product.pk, (quantity, None))
+            serializer = CartItemSerializer(CartItem(id=item_id, product=product, quantity=quantity))
+            return Response({"data": serializer.data, "message": "Cartitem updated successfully!"})
         cartitem = CartItem.objects.get(id=cartitem_id)
         cartitem.quantity = quantity
         cartitem.save()
@@ -139,6 +310,14 @@ def delete_cartitem(request):
    
     cartitem_id = request.data.get("item_id")
 
+    store = get_cart_store()
+    if store is not None:
+        cart_code, product_id = store_cart_line(request)
+        if cart_code is None or store.load(cart_code) is None:
+            return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+        store.remove(cart_code, product_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     if not cartitem_id:
         return Response({"error": "item_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -153,6 +332,47 @@ def delete_cartitem(request):
         return Response({"message": "Item deleted successfully"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 
+@api_view(['POST'])
+def batch_cart_items(request):
+    """Apply a list of add/set/remove operations to one cart and return it."""
+    serializer = CartBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    cart_code = serializer.validated_data["cart_code"]
+    operations = [(op["op"], op["product_id"], op["quantity"]) for op in serializer.validated_data["operations"]]
+
+    product_ids = {product_id for _, product_id, _ in operations}
+    missing = product_ids - set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+    if missing:
+        return Response({"error": f"Products not found: {sorted(missing)}"}, status=status.HTTP_404_NOT_FOUND)
+
+    user = request.user if request.user.is_authenticated else None
+    store = get_cart_store()
+    if store is not None:
+        if store.load(cart_code, user_id=getattr(user, "id", None), create=True) is None:
+            return Response({"error": "Cart has already been paid for"}, status=status.HTTP_400_BAD_REQUEST)
+        store.apply(cart_code, operations)
+        return Response(CartSerializer(store.snapshot(cart_code)).data)
+
+    with db_transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(cart_code=cart_code, defaults={"user": user})
+        # Locking the cart, not just its existing lines, keeps a concurrent
+        # add_item from inserting a line that sync_lines is about to create.
+        cart = Cart.objects.select_for_update().get(pk=cart.pk)
+        if cart.paid:
+            return Response({"error": "Cart has already been paid for"}, status=status.HTTP_400_BAD_REQUEST)
+        existing = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart=cart)}
+        quantities = {product_id: item.quantity for product_id, item in existing.items()}
+        for op, product_id, quantity in operations:
+            if op == "add":
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            else:
+                quantities[product_id] = quantity
+        cart.sync_lines(quantities, existing)
+
+    cart = Cart.objects.with_items().get(pk=cart.pk)
+    return Response(CartSerializer(cart).data)
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_username(request):
@@ -162,13 +382,27 @@ def get_username(request):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def user_info(request):
-    user = request.user
+    # Read-only requests authenticate with a partly loaded user from the
+    # cache; load the whole profile at once rather than field by field.
+    user = get_user_model().objects.get(pk=request.user.pk)
     serializer = UserSerializer(user)
     return Response(serializer.data)
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def order_history(request):
+    orders = Order.objects.filter(user=request.user).prefetch_related(
+        Prefetch("lines", queryset=OrderLine.objects.order_by("id"))
+    )
+    paginator = OrderCursorPagination()
+    page = paginator.paginate_queryset(orders, request)
+    serializer = OrderSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent("initiate_payment")
 def initiate_payment(request):
     try:
         tx_ref = str(uuid.uuid4())
@@ -177,15 +411,19 @@ def initiate_payment(request):
         print(f"Received cart code: {cart_code}")  
         print(f"Received user: {request.user.id}") 
 
+        # Checkout must price what the shopper sees, so write any Redis-only
+        # changes to the database first.
+        store = get_cart_store()
+        if store is not None:
+            store.flush(cart_code, wait=True)
+
         cart = get_object_or_404(Cart, cart_code=cart_code, user=request.user)
         user = request.user
 
-        amount = sum([item.quantity * item.product.price for item in cart.items.all()])
-
-        tax = Decimal("5.00")  
-        total_amount = amount + tax
+        quote = pricing.checkout_quote(cart, request.data.get("quote"))
+        total_amount = quote["total"]
 
-        currency = "USD" 
+        currency = quote["currency"]
         redirect_url = f"{BASE_URL}payment-status/"
 
         transaction = Transaction.objects.create(
@@ -194,7 +432,9 @@ def initiate_payment(request):
             amount=total_amount,
             currency=currency,
             user=user,
-            status='pending'
+            status='pending',
+            gateway='flutterwave',
+            quoted_lines=quote["lines"],
         )
         
         flutterwave_payload = {
@@ -212,17 +452,8 @@ def initiate_payment(request):
             }
         }
         
-        headers = {
-            "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}",
-            "Content-Type": "application/json"
-        }
-
         try:
-            response = requests.post(
-                'https://api.flutterwave.com/v3/payments',
-                json=flutterwave_payload,
-                headers=headers
-            )
+            response = flutterwave().post("payments", json=flutterwave_payload)
             
             print(f"Flutterwave Response Status: {response.status_code}")
             print(f"Flutterwave Response Body: {response.json()}")
@@ -232,60 +463,49 @@ def initiate_payment(request):
             else:
                 return Response(response.json(), status=response.status_code)
         
-        except requests.exceptions.RequestException as e:
-            print(f"Request Exception: {str(e)}")
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except GatewayError as e:
+            print(f"Gateway Error: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     
     except Exception as e:
         print(f"Unexpected Error: {str(e)}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+def queue_verification(transaction):
+    """Verify ``transaction`` in the background and describe it for the client."""
+    db_transaction.on_commit(lambda: schedule(verify_payment, transaction.pk))
+    return Response({
+        'message': 'Payment received',
+        'subMessage': 'We are confirming your payment',
+        'ref': transaction.ref,
+        'status': transaction.status,
+    }, status=status.HTTP_202_ACCEPTED)
+
 @api_view(['POST'])
 def payment_callback(request):
-    status = request.GET.get('status')
+    status_param = request.GET.get('status')
     tx_ref = request.GET.get('tx_ref')
     transaction_id = request.GET.get('transaction_id')
 
-    user = request.user
-
-    if status == 'successful':
-       
-        headers = {
-            "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}"
-        }
-
-        response = requests.get(f"https://api.flutterwave.com/v3/transactions/{transaction_id}/verify", headers=headers)
-        response_data = response.json()
-
-        if response_data['status'] == 'success':
-            transaction = Transaction.objects.get(ref=tx_ref)
-
-           
-            if (response_data['data']['status'] == "successful"
-                    and float(response_data['data']['amount']) == float(transaction.amount)
-                    and response_data['data']['currency'] == transaction.currency):
-              
-                transaction.status = 'completed'
-                transaction.save()
-
-                cart = transaction.cart
-                cart.paid = True
-                cart.user = user
-                cart.save()
-
-                return Response({'message': 'Payment successful!', 'subMessage': 'You have successfully made payment'})
-            else:
-                
-                return Response({'message': 'Payment verification failed.', 'subMessage': 'Your payment verification failed'})
-        else:
-            return Response({'message': 'Failed to verify transaction with Flutterwave.', 'submessgae': 'We could not verify the transaction'})
-            
-    else:
+    if status_param != 'successful':
         return Response({'message': 'Payment was not successful.'}, status=400)
+
+    transaction = Transaction.objects.filter(ref=tx_ref).first()
+    if transaction is None or not transaction_id:
+        return Response({'message': 'Transaction not found', 'subMessage': 'We could not find your transaction record'}, status=404)
+
+    # Only record what the redirect told us; verify_payment checks it with
+    # Flutterwave and settles the transaction.
+    if transaction.status == 'pending':
+        transaction.gateway = 'flutterwave'
+        transaction.gateway_ref = str(transaction_id)
+        transaction.save(update_fields=['gateway', 'gateway_ref', 'modified_at'])
+    return queue_verification(transaction)
     
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent("initiate_paymentstripe")
 def initiate_paymentstripe(request):
     try:
         payment_id = str(uuid.uuid4())
@@ -294,17 +514,21 @@ def initiate_paymentstripe(request):
         print(f"Received cart code: {cart_code}")  
         print(f"Received user: {request.user.id}") 
 
+        # Checkout must price what the shopper sees, so write any Redis-only
+        # changes to the database first.
+        store = get_cart_store()
+        if store is not None:
+            store.flush(cart_code, wait=True)
+
         cart = get_object_or_404(Cart, cart_code=cart_code, user=request.user)
         user = request.user
 
-        amount = sum([item.quantity * item.product.price for item in cart.items.all()])
-
-        tax = Decimal("5.00")  
-        total_amount = amount + tax
+        quote = pricing.checkout_quote(cart, request.data.get("quote"))
+        total_amount = quote["total"]
 
         
         stripe_amount = int(total_amount * 100)
-        currency = "usd"  
+        currency = quote["currency"].lower()
         
         
         transaction = Transaction.objects.create(
@@ -313,14 +537,15 @@ def initiate_paymentstripe(request):
             amount=total_amount,
             currency=currency,
             user=user,
-            status='pending'
+            status='pending',
+            gateway='stripe',
+            quoted_lines=quote["lines"],
         )
         
         
         try:
-            stripe.api_key = settings.STRIPE_SECRET_KEY
-            
-            checkout_session = stripe.checkout.Session.create(
+            checkout_session = stripe_call(
+                stripe.checkout.Session.create,
                 payment_method_types=['card'],
                 line_items=[{
                     'price_data': {
@@ -344,6 +569,7 @@ def initiate_paymentstripe(request):
             )
             
             print(f"Stripe Session Created: {checkout_session.id}")
+            Transaction.objects.filter(pk=transaction.pk).update(gateway_ref=checkout_session.id)
             
             
             return Response({
@@ -351,6 +577,8 @@ def initiate_paymentstripe(request):
                 'url': checkout_session.url
             }, status=status.HTTP_200_OK)
             
+        except GatewayError as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except stripe.error.StripeError as e:
             print(f"Stripe Error: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -361,59 +589,34 @@ def initiate_paymentstripe(request):
 
 @api_view(['GET'])
 def payment_success(request):
-    try:
-        session_id = request.GET.get('session_id')
-        print(session_id)
-        if not session_id:
-            return Response({'message': 'No session ID provided'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        
-        
-        checkout_session = stripe.checkout.Session.retrieve(session_id)
-        
-        if checkout_session.payment_status == 'paid':
-           
-            payment_id = checkout_session.client_reference_id
-            
-            try:
-               
-                transaction = Transaction.objects.get(ref=payment_id)
-                transaction.status = 'completed'
-                transaction.save()
-                
-                
-                cart = transaction.cart
-                cart.paid = True
-                cart.save()
-                
-                return Response({
-                    'message': 'Payment successful!', 
-                    'subMessage': 'You have successfully made payment'
-                }, status=status.HTTP_200_OK)
-                
-            except Transaction.DoesNotExist:
-                return Response({
-                    'message': 'Transaction not found',
-                    'subMessage': 'We could not find your transaction record'
-                }, status=status.HTTP_404_NOT_FOUND)
-        else:
-            return Response({
-                'message': 'Payment not completed',
-                'subMessage': 'Your payment was not completed successfully'
-            }, status=status.HTTP_400_BAD_REQUEST)
-            
-    except stripe.error.StripeError as e:
-        return Response({
-            'message': 'Stripe verification error',
-            'subMessage': str(e)
-        }, status=status.HTTP_400_BAD_REQUEST)
-        
-    except Exception as e:
+    session_id = request.GET.get('session_id')
+    if not session_id:
+        return Response({'message': 'No session ID provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+    transaction = Transaction.objects.filter(gateway='stripe', gateway_ref=session_id).first()
+    if transaction is None:
         return Response({
-            'message': 'Something went wrong',
-            'subMessage': str(e)
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            'message': 'Transaction not found',
+            'subMessage': 'We could not find your transaction record'
+        }, status=status.HTTP_404_NOT_FOUND)
+    return queue_verification(transaction)
+
+@api_view(['GET'])
+def payment_status(request):
+    """Cheap polling endpoint for the payment status page."""
+    ref = request.GET.get('ref')
+    session_id = request.GET.get('session_id')
+    if ref:
+        transactions = Transaction.objects.filter(ref=ref)
+    elif session_id:
+        transactions = Transaction.objects.filter(gateway='stripe', gateway_ref=session_id)
+    else:
+        return Response({'error': 'ref or session_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    transaction = transactions.values('ref', 'status').first()
+    if transaction is None:
+        return Response({'error': 'Transaction not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({**transaction, 'paid': transaction['status'] == 'completed'})
 
 @api_view(['GET'])
 def payment_canceled(request):
@@ -430,36 +633,13 @@ def stripe_webhook(request):
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     
     try:
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         event = stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
         
-       
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            
-            
-            if session.payment_status == 'paid':
-                payment_id = session.client_reference_id
-                
-              
-                try:
-                    transaction = Transaction.objects.get(ref=payment_id)
-                    
-                  
-                    if transaction.status != 'completed':
-                        transaction.status = 'completed'
-                        transaction.save()
-                        
-                   
-                        cart = transaction.cart
-                        cart.paid = True
-                        cart.save()
-                        
-                except Transaction.DoesNotExist:
-                    print(f"Transaction with reference {payment_id} not found")
-                
+        # Store and acknowledge; process_stripe_events applies it. Stripe's
+        # redeliveries hit the unique event id and are dropped.
+        webhooks.store_event(event, json.loads(payload))
         return Response({'status': 'success'}, status=status.HTTP_200_OK)
         
     except ValueError as e:
@@ -473,6 +653,7 @@ def stripe_webhook(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+@cached_catalog_response("products_by_category")
 @api_view(['GET'])
 def products_by_category(request, category_name):
     category_name = category_name.capitalize()  
@@ -482,15 +663,22 @@ def products_by_category(request, category_name):
         return Response({'error': 'Invalid category'}, status=status.HTTP_400_BAD_REQUEST)
 
     products = Product.objects.filter(category=category_name)
-    serializer = ProductSerializer(products, many=True, context={'request': request})
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return product_list_response(request, products, context={'request': request})
 
+@api_view(["GET"])
+# Public: a stale Authorization header must not turn a search into a 401.
+@authentication_classes([])
+@throttle_classes([SearchThrottle])
 def product_search_api(request):
     query = request.GET.get("q", "")
+    try:
+        limit = min(max(int(request.GET.get("limit", search.DEFAULT_LIMIT)), 1), search.MAX_LIMIT)
+    except ValueError:
+        limit = search.DEFAULT_LIMIT
     results = []
 
     if query:
-        products = Product.objects.filter(name__icontains=query)
+        products = search.search_products(query, limit=limit)
         results = [
             {
                 "id": product.id,
@@ -503,3 +691,19 @@ def product_search_api(request):
         ]
 
     return JsonResponse({"results": results})
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def throttle_stats(request):
+    """Rejected requests per throttle scope, across workers when buckets are in Redis."""
+    return Response({"rejected": get_bucket_store().rejections()})
+
+def product_suggest_api(request):
+    query = request.GET.get("q", "")
+    try:
+        limit = min(max(int(request.GET.get("limit", typeahead.DEFAULT_LIMIT)), 1), typeahead.MAX_LIMIT)
+    except ValueError:
+        limit = typeahead.DEFAULT_LIMIT
+
+    suggestions = typeahead.typeahead_index.suggest(query, limit=limit) if query else []
+    return JsonResponse({"suggestions": suggestions})
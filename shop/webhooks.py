@@ -0,0 +1,104 @@
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import payments
+from .models import StripeEvent, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+def store_event(event, payload):
+    """Record a verified Stripe event; redelivered events are ignored by event id."""
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(
+            event_id=event["id"],
+            type=event["type"],
+            payload=payload,
+            stripe_created=datetime.fromtimestamp(event["created"], tz=dt_timezone.utc),
+        )],
+        ignore_conflicts=True,
+    )
+
+
+def _session_transaction(event):
+    session = event.payload["data"]["object"]
+    transaction = Transaction.objects.select_related("cart").filter(ref=session.get("client_reference_id")).first()
+    if transaction is None:
+        logger.warning("Stripe event %s: no transaction %r", event.event_id, session.get("client_reference_id"))
+    return session, transaction
+
+
+def handle_session_paid(event):
+    session, transaction = _session_transaction(event)
+    if transaction is not None and session.get("payment_status") in ("paid", "no_payment_required"):
+        payments.mark_transaction_completed(transaction)
+
+
+def handle_session_failed(event):
+    _, transaction = _session_transaction(event)
+    if transaction is not None:
+        payments.mark_transaction_failed(transaction)
+
+
+HANDLERS = {
+    "checkout.session.completed": handle_session_paid,
+    "checkout.session.async_payment_succeeded": handle_session_paid,
+    "checkout.session.async_payment_failed": handle_session_failed,
+    "checkout.session.expired": handle_session_failed,
+}
+
+
+def process_events(batch_size=None):
+    """Apply up to ``batch_size`` unprocessed events, oldest first.
+
+    Handlers are idempotent, so an event that is applied twice (or after a
+    later one) does no harm. A failing event is retried on later runs, after
+    a delay that doubles from STRIPE_EVENT_RETRY_DELAY seconds, until it has
+    been tried STRIPE_EVENT_MAX_ATTEMPTS times. Returns the number of
+    events processed and their average and worst receive-to-process latency.
+    """
+    batch_size = batch_size or settings.STRIPE_EVENT_BATCH
+    processed, latencies = 0, []
+    with db_transaction.atomic():
+        now = timezone.now()
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), processed_at__isnull=True)
+            .order_by("stripe_created", "id")[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            handler = HANDLERS.get(event.type)
+            try:
+                with db_transaction.atomic():
+                    if handler is not None:
+                        handler(event)
+            except Exception as e:
+                logger.exception("Processing Stripe event %s failed", event.event_id)
+                event.error = repr(e)
+                if event.attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+                    event.processed_at = timezone.now()
+                else:
+                    delay = settings.STRIPE_EVENT_RETRY_DELAY * 2 ** (event.attempts - 1)
+                    event.next_attempt_at = now + timedelta(seconds=delay)
+            else:
+                event.error = ""
+                event.processed_at = timezone.now()
+                processed += 1
+                latencies.append((event.processed_at - event.received_at).total_seconds())
+        StripeEvent.objects.bulk_update(events, ["attempts", "error", "processed_at", "next_attempt_at"])
+
+    result = {
+        "processed": processed,
+        "failed": len(events) - processed,
+        "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "max_latency": round(max(latencies), 3) if latencies else None,
+    }
+    if events:
+        logger.info("Processed %(processed)d Stripe events (%(failed)d failed), latency avg %(avg_latency)ss max %(max_latency)ss", result)
+    return result
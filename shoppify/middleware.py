@@ -0,0 +1,58 @@
+import os
+from urllib.parse import urlparse
+
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.responders import MissingFileError
+from whitenoise.string_utils import ensure_leading_trailing_slash
+
+from shop.images import DERIVATIVE_NAME_RE
+
+
+class MediaWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that also serves uploaded media from ``WHITENOISE_MEDIA_DIRS``.
+
+    Files uploaded after the worker started are looked up on first request
+    and then kept in the file table like any other. Image derivatives carry a
+    content hash in their name and are served as immutable.
+    """
+
+    def __init__(self, get_response=None, settings=settings):
+        self.media_prefix = ensure_leading_trailing_slash(urlparse(settings.MEDIA_URL).path)
+        super().__init__(get_response, settings=settings)
+        self.media_directories = []
+        for directory in getattr(settings, "WHITENOISE_MEDIA_DIRS", []):
+            root = os.path.join(os.path.abspath(settings.MEDIA_ROOT), directory).rstrip(os.path.sep) + os.path.sep
+            prefix = ensure_leading_trailing_slash(self.media_prefix + directory)
+            self.media_directories.append((root, prefix))
+            self.add_files(root, prefix=prefix)
+
+    def __call__(self, request):
+        if not self.autorefresh and request.path_info.startswith(self.media_prefix):
+            static_file = self.files.get(request.path_info) or self.find_media_file(request.path_info)
+            if static_file is not None:
+                return self.serve(static_file, request)
+            return self.get_response(request)
+        return super().__call__(request)
+
+    def find_media_file(self, url):
+        if not self.url_is_canonical(url):
+            return None
+        for root, prefix in self.media_directories:
+            if not url.startswith(prefix):
+                continue
+            path = os.path.join(root, url[len(prefix):])
+            if os.path.commonprefix((root, path)) != root or not os.path.isfile(path):
+                continue
+            try:
+                static_file = self.find_file_at_path(path, url)
+            except MissingFileError:
+                continue
+            self.files[url] = static_file
+            return static_file
+        return None
+
+    def immutable_file_test(self, path, url):
+        if url.startswith(self.media_prefix):
+            return bool(DERIVATIVE_NAME_RE.search(url))
+        return super().immutable_file_test(path, url)
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
+from decimal import Decimal
+
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     'account',
     'shop',
@@ -44,11 +49,13 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'django_filters',
     'corsheaders',
+    'django_celery_beat',
     
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'shoppify.middleware.MediaWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', 
     'django.middleware.common.CommonMiddleware',
@@ -62,8 +69,11 @@ REST_FRAMEWORK = {
    
     'DEFAULT_AUTHENTICATION_CLASSES': (
         
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'account.authentication.CachedJWTAuthentication',
+    ),
+    # Reverse proxies in front of the app. Throttles key anonymous clients by
+    # IP, and with this unset DRF would trust any client's X-Forwarded-For.
+    'NUM_PROXIES': int(os.environ.get("NUM_PROXIES", "0")),
     
 }
 
@@ -98,9 +108,108 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLite has no row locks, so select_for_update() is a no-op there.
+        # Starting every transaction with BEGIN IMMEDIATE takes the write lock
+        # up front instead, and a transaction that reads before it writes then
+        # waits for the lock rather than failing with "database is locked".
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # A shared-cache in-memory database fails concurrent writers with
+        # "table is locked" instead of waiting, so tests use a file.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# The typeahead index (shop.typeahead) is rebuilt in the background once the
+# catalog version moves or it is older than this many seconds. The age limit
+# is what brings other workers up to date when the cache, and with it the
+# catalog version, is per process.
+TYPEAHEAD_MAX_AGE = 5 * 60
+
+# Token-bucket throttles (shop.throttling): each client may make ``burst``
+# requests at once, refilled at ``rate`` per second. Buckets are kept per
+# process unless THROTTLE_REDIS_URL points them at a shared Redis.
+TOKEN_BUCKETS = {
+    "search": {"rate": 5, "burst": 20},
+    "add_item": {"rate": 2, "burst": 20},
+    "login": {"rate": 0.2, "burst": 5},
+}
+THROTTLE_REDIS_URL = os.environ.get("THROTTLE_REDIS_URL")
+
+# Live carts are kept in Redis and written back in batches when this is set;
+# otherwise every cart mutation goes straight to the database.
+CART_STORE_URL = os.environ.get("CART_STORE_URL")
+CART_STORE_TTL = 60 * 60 * 24 * 7
+CART_STORE_FLUSH_BATCH = 1000
+
+
+# Celery
+# https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", REDIS_URL)
+
+# Without a broker, shop.tasks.schedule logs and drops background work rather
+# than running it inside the request. The test runner turns on eager mode.
+CELERY_TASK_ALWAYS_EAGER = False
+CELERY_TASK_EAGER_PROPAGATES = True
+TEST_RUNNER = "shoppify.test_runner.CeleryEagerTestRunner"
+
+# Periodic tasks are stored by django-celery-beat; entries below are synced
+# into its tables when beat starts and can then be tuned from the admin.
+CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "flush-cart-store": {
+        "task": "shop.tasks.flush_cart_store",
+        "schedule": 30.0,
+    },
+    "process-stripe-events": {
+        "task": "shop.tasks.process_stripe_events",
+        "schedule": 5.0,
+    },
+    "reconcile-transactions": {
+        "task": "shop.tasks.reconcile_transactions",
+        "schedule": crontab(minute="*/15"),
+    },
+    "purge-idempotency-keys": {
+        "task": "shop.tasks.purge_idempotency_keys",
+        "schedule": crontab(minute=43),
+    },
+    "reap-abandoned-carts": {
+        "task": "shop.tasks.reap_abandoned_carts",
+        "schedule": crontab(minute=17),
+    },
 }
 
+# Unpaid carts untouched for this long are deleted by reap_abandoned_carts,
+# in chunks of ABANDONED_CART_BATCH so each delete stays short.
+ABANDONED_CART_MAX_AGE = timedelta(days=30)
+ABANDONED_CART_BATCH = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -134,11 +243,30 @@ USE_TZ = True
 
 MEDIA_URL = '/media/'
 
+# Uploads live under the project root (e.g. img/), so only the upload
+# directories listed here are ever served.
+MEDIA_ROOT = BASE_DIR
+
+WHITENOISE_MEDIA_DIRS = ['img']
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = 'static/'
 
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Content-hashed file names with gzip/brotli siblings, served by WhiteNoise
+# with far-future immutable Cache-Control headers.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -150,8 +278,63 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60)
 }
 
+# Seconds CachedJWTAuthentication keeps a user for read-only requests.
+AUTH_USER_CACHE_TIMEOUT = 60
+
+SIMILAR_PRODUCTS_K = 8
+
 FRONTEND_BASE_URL="https://shopifyfront.onrender.com/"
 
+# Checkout pricing (shop.pricing): a flat tax added to every order, the
+# currency charged, how long a computed quote stays cached for an unchanged
+# cart, and how long a signed quote handed to the client is accepted back.
+CHECKOUT_TAX = Decimal("5.00")
+CHECKOUT_CURRENCY = "USD"
+QUOTE_CACHE_TIMEOUT = 60 * 15
+QUOTE_MAX_AGE = timedelta(minutes=30)
+
+# Idempotency-Key handling on the payment initiation views (shop.idempotency):
+# stored responses are replayed for IDEMPOTENCY_KEY_TTL; a duplicate of a
+# request still running polls every IDEMPOTENCY_POLL_INTERVAL seconds for up
+# to IDEMPOTENCY_WAIT_TIMEOUT seconds; a key held longer than
+# IDEMPOTENCY_LOCK_TIMEOUT without a response is treated as abandoned.
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(minutes=2)
+
 FLUTTERWAVE_SECRET_KEY="FLWSECK_TEST-a2fdcc28cba7a98f5f64bb54d482f2a4-X"
 
-STRIPE_SECRET_KEY='sk_test_51R8GYiHTFDTH39QiSz4D37h6dnecEs7pHHMZkkCbl8ApPsBV4jJKFlvgM4NLJeqQikedLy3pBPLLwz9NPIpYFQmR00lbtoNssn'
\ No newline at end of file
+FLUTTERWAVE_BASE_URL = os.environ.get("FLUTTERWAVE_BASE_URL", "https://api.flutterwave.com/v3")
+
+STRIPE_SECRET_KEY='sk_test_51R8GYiHTFDTH39QiSz4D37h6dnecEs7pHHMZkkCbl8ApPsBV4jJKFlvgM4NLJeqQikedLy3pBPLLwz9NPIpYFQmR00lbtoNssn'
+
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE", "https://api.stripe.com")
+
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
+
+# Webhook events are stored on receipt and applied in batches of this size;
+# a failed event is retried after STRIPE_EVENT_RETRY_DELAY seconds, doubling
+# each time, and given up on after STRIPE_EVENT_MAX_ATTEMPTS.
+STRIPE_EVENT_BATCH = 100
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+STRIPE_EVENT_RETRY_DELAY = 30
+
+# reconcile_transactions asks the gateways about transactions still pending
+# after RECONCILE_MIN_AGE, RECONCILE_BATCH at a time with RECONCILE_WORKERS
+# concurrent requests, and gives up on them after RECONCILE_ABANDON_AFTER.
+RECONCILE_MIN_AGE = timedelta(minutes=15)
+RECONCILE_ABANDON_AFTER = timedelta(days=2)
+RECONCILE_BATCH = 200
+RECONCILE_WORKERS = 8
+
+# Outbound payment gateway calls (shop.gateway): (connect, read) timeouts in
+# seconds, retries after the first attempt, base backoff in seconds, pooled
+# connections per gateway, and the circuit breaker's failure threshold and
+# cool-down in seconds.
+PAYMENT_GATEWAY_TIMEOUT = (3.05, 15)
+PAYMENT_GATEWAY_RETRIES = 2
+PAYMENT_GATEWAY_BACKOFF = 0.25
+PAYMENT_GATEWAY_POOL_SIZE = 20
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = 5
+PAYMENT_GATEWAY_BREAKER_RESET = 30
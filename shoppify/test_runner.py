@@ -0,0 +1,11 @@
+from django.test.runner import DiscoverRunner
+
+from .celery import app
+
+
+class CeleryEagerTestRunner(DiscoverRunner):
+    """DiscoverRunner that runs Celery tasks inline, as there is no broker under test."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
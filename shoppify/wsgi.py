@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shoppify.settings')
 
 application = get_wsgi_application()
+
+# Build the in-process autocomplete index before the first request arrives.
+from shop.typeahead import typeahead_index  # noqa: E402
+
+typeahead_index.warm()